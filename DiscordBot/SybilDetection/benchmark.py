@@ -0,0 +1,246 @@
+import argparse
+from contextlib import contextmanager
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import sys
+import time
+
+
+import numpy as np
+import scipy
+
+from generate_graph import SybilGraphGenerator
+from graph_cache import build_cache, default_cache_dir
+from sybilrank import SybilRank
+from sybilscar import SybilScar
+
+
+SOLVERS = ['sybilrank', 'sybilscar']
+# Phases whose cost scales with the number of edges
+EDGE_PHASES = ['build_cache', 'read_network', 'matrix_build', 'propagation']
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its high-water mark (VmHWM), which gives
+    # per-phase peaks; elsewhere the peak is cumulative over the process
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = []
+
+
+    @contextmanager
+    def phase(self, name: str):
+        reset_peak_rss()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        self.phases.append({'phase': name, 'seconds': seconds, 'peak_rss_mb': peak_rss_mb()})
+
+
+    def add_throughput(self, num_edges: int):
+        for record in self.phases:
+            if record['phase'] in EDGE_PHASES:
+                record['edges_per_sec'] = num_edges / record['seconds'] if record['seconds'] > 0 else None
+
+
+def run_solver(solver_name: str, network_file: str, train_file: str, out_file: str, max_iter: int):
+    '''
+    Run one solver phase by phase; called in a fresh process so peak RSS and
+    caches of earlier runs do not leak into the measurement.
+    '''
+    solver = SybilRank(max_iter=max_iter) if solver_name == 'sybilrank' else SybilScar(max_iter=max_iter)
+    timer = PhaseTimer()
+
+    with timer.phase('build_cache'):
+        build_cache(network_file, default_cache_dir(network_file))
+    with timer.phase('read_network'):
+        solver.read_network(network_file)
+        solver.set_prior(train_file)
+    if solver_name == 'sybilrank':
+        with timer.phase('matrix_build'):
+            solver.trans_mat = solver.get_trans_mat()
+        with timer.phase('propagation'):
+            solver.power_iteration()
+        with timer.phase('normalization'):
+            solver.normalize_posterior()
+    else:
+        with timer.phase('matrix_build'):
+            solver.adj_mat = solver.get_adj_mat()
+        with timer.phase('propagation'):
+            solver.lbp(mode='sparse')
+    with timer.phase('write'):
+        solver.write_posterior(out_file)
+    timer.add_throughput(len(solver.indices))
+    return timer.phases, len(solver.indices), solver.result.num_iter
+
+
+def prepare_graph(work_dir: str, num_nodes: int, avg_degree: float, seed: int):
+    # Two honest nodes per Sybil, one attack edge per 100 honest nodes
+    name = f'graph_{num_nodes}_{avg_degree:g}_{seed}'
+    network_file = os.path.join(work_dir, name + '.txt')
+    train_file = os.path.join(work_dir, name + '_train.txt')
+    if not (os.path.exists(network_file) and os.path.exists(train_file)):
+        num_honest = num_nodes * 2 // 3
+        generator = SybilGraphGenerator(
+            num_honest=num_honest,
+            num_sybil=num_nodes - num_honest,
+            avg_degree_honest=avg_degree,
+            avg_degree_sybil=avg_degree,
+            n_attack=max(1, num_honest // 100),
+            seed=seed,
+        )
+        generator.write_text(network_file)
+        generator.write_train(train_file, 100)
+    return network_file, train_file
+
+
+def run_benchmark(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    ctx = mp.get_context()
+    results = []
+    for num_nodes in args.sizes:
+        network_file, train_file = prepare_graph(args.work_dir, num_nodes, args.avg_degree, args.seed)
+        for solver_name in args.solvers:
+            out_file = os.path.join(args.work_dir, f'posterior_{solver_name}_{num_nodes}.txt')
+            best = None
+            for _ in range(args.repeat):
+                with ctx.Pool(1, maxtasksperchild=1) as pool:
+                    phases, num_edges, num_iter = pool.apply(
+                        run_solver, (solver_name, network_file, train_file, out_file, args.max_iter),
+                    )
+                if best is None:
+                    best = phases
+                else:
+                    # Keep the fastest time and the lowest peak of each phase
+                    for record, new in zip(best, phases):
+                        if new['seconds'] < record['seconds']:
+                            record['seconds'] = new['seconds']
+                            if 'edges_per_sec' in new:
+                                record['edges_per_sec'] = new['edges_per_sec']
+                        record['peak_rss_mb'] = min(record['peak_rss_mb'], new['peak_rss_mb'])
+            for record in best:
+                results.append({
+                    'solver': solver_name,
+                    'num_nodes': num_nodes,
+                    'num_edges': num_edges,
+                    'num_iter': num_iter,
+                    **record,
+                })
+                print(
+                    f"{solver_name:>10} {num_nodes:>10} {record['phase']:>14} "
+                    f"{record['seconds']:>10.4f}s {record['peak_rss_mb']:>9.1f}MB"
+                    + (f" {record['edges_per_sec']:>14.0f} edges/s" if record.get('edges_per_sec') else '')
+                )
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'config': {
+            'sizes': args.sizes,
+            'avg_degree': args.avg_degree,
+            'max_iter': args.max_iter,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+
+
+def compare(base: dict, new: dict, threshold: float, min_seconds: float):
+    '''
+    Return the phases of `new` that are slower, or use more memory, than in
+    `base` by more than `threshold` (relative). Timings below `min_seconds`
+    are too noisy to judge and only their memory is compared.
+    '''
+    key = lambda record: (record['solver'], record['num_nodes'], record['phase'])
+    base_records = {key(record): record for record in base['results']}
+    regressions = []
+    for record in new['results']:
+        old = base_records.get(key(record))
+        if old is None:
+            continue
+        for metric in ['seconds', 'peak_rss_mb']:
+            if metric == 'seconds' and max(old[metric], record[metric]) < min_seconds:
+                continue
+            if record[metric] > old[metric] * (1 + threshold):
+                regressions.append({
+                    'solver': record['solver'],
+                    'num_nodes': record['num_nodes'],
+                    'phase': record['phase'],
+                    'metric': metric,
+                    'base': old[metric],
+                    'new': record[metric],
+                    'change': record[metric] / old[metric] - 1 if old[metric] else float('inf'),
+                })
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out_file', type=str, default='benchmark.json')
+    parser.add_argument('--work_dir', type=str, default='benchmark_graphs')
+    parser.add_argument('--solvers', type=str, nargs='+', default=SOLVERS, choices=SOLVERS)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--avg_degree', type=float, default=20.0)
+    parser.add_argument('--max_iter', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=152)
+    # Compare two result files instead of running the benchmark
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('BASE', 'NEW'), default=None)
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--min_seconds', type=float, default=0.05)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.compare:
+        with open(args.compare[0], 'r') as f:
+            base = json.load(f)
+        with open(args.compare[1], 'r') as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.min_seconds)
+        for r in regressions:
+            print(
+                f"REGRESSION {r['solver']} n={r['num_nodes']} {r['phase']} {r['metric']}: "
+                f"{r['base']:.4f} -> {r['new']:.4f} ({r['change']:+.1%})"
+            )
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    report = run_benchmark(args)
+    with open(args.out_file, 'w') as f:
+        json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -0,0 +1,74 @@
+import argparse
+import sys
+import tempfile
+
+
+import numpy as np
+
+from benchmark import prepare_graph
+from sybilscar import SybilScar
+
+
+def run_modes(args):
+    '''
+    Run SybilSCAR's LBP once per mode on the same graph and prior. Returns
+    (name, posterior, num_iter) per run; the first is the loop mode the
+    others are checked against.
+    '''
+    solver = SybilScar(
+        max_iter=args.max_iter,
+        network_file=args.network_file,
+        train_file=args.train_file,
+    )
+    runs = [
+        ('loop', {'mode': 'loop'}),
+        (f'loop, {args.num_threads} threads', {'mode': 'loop', 'num_threads': args.num_threads}),
+        ('sparse', {'mode': 'sparse'}),
+        (f'sparse, {args.num_workers} workers', {'mode': 'sparse', 'num_workers': args.num_workers}),
+    ]
+    results = []
+    for name, lbp_args in runs:
+        solver.lbp(**lbp_args)
+        results.append((name, solver.posterior.copy(), solver.result.num_iter))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    # Without a network file a graph is generated, as in benchmark.py
+    parser.add_argument('--network_file', type=str, default=None)
+    parser.add_argument('--train_file', type=str, default=None)
+    parser.add_argument('--num_nodes', type=int, default=3000)
+    parser.add_argument('--avg_degree', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=152)
+    parser.add_argument('--max_iter', type=int, default=10)
+    parser.add_argument('--num_threads', type=int, default=4)
+    parser.add_argument('--num_workers', type=int, default=2)
+    # Largest accepted difference from the loop mode in any posterior
+    parser.add_argument('--atol', type=float, default=1e-12)
+    args = parser.parse_args()
+    if (args.network_file is None) != (args.train_file is None):
+        parser.error('--network_file and --train_file go together')
+    return args
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.network_file is None:
+            args.network_file, args.train_file = prepare_graph(work_dir, args.num_nodes, args.avg_degree, args.seed)
+        results = run_modes(args)
+
+    (_, reference, reference_iter), *others = results
+    print(f'{len(reference)} nodes, {reference_iter} iterations')
+    failed = False
+    for name, posterior, num_iter in others:
+        diff = float(np.abs(posterior - reference).max())
+        ok = diff <= args.atol and num_iter == reference_iter
+        failed |= not ok
+        print(f"{name:>20}: max abs diff {diff:.3g} over {num_iter} iterations {'OK' if ok else 'MISMATCH'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(main(args))
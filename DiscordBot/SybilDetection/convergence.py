@@ -0,0 +1,93 @@
+import math
+from typing import Optional
+
+
+import numpy as np
+
+
+NORMS = ['l1', 'linf']
+
+
+def residuals(previous: np.ndarray, current: np.ndarray):
+    # For a batch of posteriors (one per column) the L1 residual is that of
+    # the slowest column, so the batch stops once every column converged
+    diff = np.abs(current - previous)
+    return float(np.max(diff.sum(axis=0), initial=0.0)), float(diff.max(initial=0.0))
+
+
+def is_converged(l1: float, linf: float, tol: Optional[float], norm: str = 'l1') -> bool:
+    if tol is None:
+        return False
+    return (l1 if norm == 'l1' else linf) < tol
+
+
+def iteration_budget(max_iter: int, num_nodes: int, tol: Optional[float] = None) -> int:
+    '''
+    Without a tolerance both solvers keep their original fixed budget of
+    min(max_iter, log(num_nodes)) iterations (SybilRank's early termination).
+    With a tolerance, max_iter is a hard cap and the residual decides.
+    '''
+    if tol is None and num_nodes > 1 and math.log(num_nodes) < max_iter:
+        return int(math.log(num_nodes))
+    return max_iter
+
+
+class ConvergenceResult:
+    '''
+    Per-iteration telemetry of a propagation run: the L1 and L-infinity
+    residuals between successive posteriors and the wall time of each
+    iteration.
+    '''
+    def __init__(self, max_iter: int, tol: Optional[float] = None, norm: str = 'l1'):
+        assert norm in NORMS
+        self.max_iter = max_iter
+        self.tol = tol
+        self.norm = norm
+        self.residuals_l1 = []
+        self.residuals_linf = []
+        self.iter_times = []
+        self.converged = False
+
+
+    @property
+    def num_iter(self):
+        return len(self.iter_times)
+
+
+    @property
+    def total_time(self):
+        return sum(self.iter_times)
+
+
+    def record(self, l1: float, linf: float, seconds: float) -> bool:
+        '''
+        Append one iteration and return True once the residual is below tol.
+        '''
+        self.residuals_l1.append(l1)
+        self.residuals_linf.append(linf)
+        self.iter_times.append(seconds)
+        self.converged = is_converged(l1, linf, self.tol, self.norm)
+        return self.converged
+
+
+    def summary(self) -> str:
+        if not self.iter_times:
+            return "0 iterations"
+        status = "converged" if self.converged else "stopped"
+        return (
+            f"{status} after {self.num_iter}/{self.max_iter} iterations in {self.total_time:.3f}s, "
+            f"residual l1={self.residuals_l1[-1]:.3e} linf={self.residuals_linf[-1]:.3e}"
+        )
+
+
+    def to_dict(self) -> dict:
+        return {
+            'max_iter': self.max_iter,
+            'tol': self.tol,
+            'norm': self.norm,
+            'converged': self.converged,
+            'num_iter': self.num_iter,
+            'residuals_l1': self.residuals_l1,
+            'residuals_linf': self.residuals_linf,
+            'iter_times': self.iter_times,
+        }
@@ -1,42 +1,153 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-from sklearn.metrics import roc_auc_score
+
+import numpy as np
+from scipy.stats import rankdata
+
+
+# Upper bound on the (replicates x scores) matrix size while bootstrapping
+BOOTSTRAP_CHUNK_ELEMENTS = 1 << 22
+
+
+def dedup_keep_last(ids: np.ndarray, *values: np.ndarray):
+    # Sort by id and keep the last occurrence of each id, matching what
+    # filling a dict in file order used to do
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    keep = np.append(ids[1:] != ids[:-1], True)
+    return (ids[keep],) + tuple(value[order][keep] for value in values)
+
+
+def read_ground_truth(gt_file: str):
+    '''
+    Returns sorted node ids and their labels (1 for the first line, 0 for the
+    second line of the file).
+    '''
+    with open(gt_file, 'r') as f:
+        pos_nodes = np.array(f.readline().split(), dtype=np.int64)
+        neg_nodes = np.array(f.readline().split(), dtype=np.int64)
+    ids = np.concatenate([pos_nodes, neg_nodes])
+    labels = np.concatenate([np.ones(len(pos_nodes), dtype=np.int8), np.zeros(len(neg_nodes), dtype=np.int8)])
+    return dedup_keep_last(ids, labels)
+
+
+def read_predictions(pred_file: str):
+    data = np.loadtxt(pred_file, dtype=[('id', np.int64), ('score', np.float64)], ndmin=1)
+    return dedup_keep_last(data['id'], data['score'])
+
+
+def join(pred_ids, scores, gt_ids, gt_labels):
+    '''
+    Keep the predictions whose node has a ground-truth label; returns the
+    (labels, scores) of those nodes.
+    '''
+    pos = np.searchsorted(gt_ids, pred_ids)
+    pos[pos == len(gt_ids)] = 0
+    found = gt_ids[pos] == pred_ids if len(gt_ids) else np.zeros(len(pred_ids), dtype=bool)
+    return gt_labels[pos[found]], scores[found]
+
+
+def rank_auc(pos_scores: np.ndarray, neg_scores: np.ndarray):
+    '''
+    ROC AUC via the Mann-Whitney U statistic with tied scores sharing their
+    average rank (same as sklearn's roc_auc_score).
+    '''
+    num_pos, num_neg = len(pos_scores), len(neg_scores)
+    ranks = rankdata(np.concatenate([pos_scores, neg_scores]))
+    return (ranks[:num_pos].sum() - num_pos * (num_pos + 1) / 2) / (num_pos * num_neg)
+
+
+def resample_counts(rng: np.random.Generator, n: int, size: int):
+    # How often each of n items is drawn in each of `size` bootstrap resamples
+    draws = rng.integers(0, n, (size, n)) + n * np.arange(size)[:, None]
+    return np.bincount(draws.ravel(), minlength=size * n).reshape(size, n)
+
+
+def bootstrap_auc(pos_scores: np.ndarray, neg_scores: np.ndarray, n_bootstrap: int, seed: int):
+    '''
+    Stratified bootstrap: positives and negatives are resampled separately so
+    every replicate has both classes. A resample is represented by per-item
+    draw counts, and its AUC is the count-weighted number of (positive,
+    negative) pairs the positive wins (ties count 1/2). The negatives are
+    sorted once, so every replicate costs one cumulative sum instead of a sort.
+    '''
+    rng = np.random.default_rng(seed)
+    num_pos, num_neg = len(pos_scores), len(neg_scores)
+    neg_sorted = np.sort(neg_scores)
+    below = np.searchsorted(neg_sorted, pos_scores, side='left')
+    not_above = np.searchsorted(neg_sorted, pos_scores, side='right')
+
+    chunk = max(1, BOOTSTRAP_CHUNK_ELEMENTS // (num_pos + num_neg))
+    aucs = []
+    for start in range(0, n_bootstrap, chunk):
+        size = min(chunk, n_bootstrap - start)
+        pos_counts = resample_counts(rng, num_pos, size)
+        neg_counts = resample_counts(rng, num_neg, size)
+        neg_cumsum = np.zeros((size, num_neg + 1))
+        np.cumsum(neg_counts, axis=1, out=neg_cumsum[:, 1:])
+        wins = neg_cumsum[:, below] + 0.5 * (neg_cumsum[:, not_above] - neg_cumsum[:, below])
+        aucs.append((pos_counts * wins).sum(axis=1) / (num_pos * num_neg))
+    return np.concatenate(aucs) if aucs else np.zeros(0)
+
+
+# Ground truth shared by the evaluation workers, set by init_worker
+_ground_truth = None
+
+
+def init_worker(gt_file: str):
+    global _ground_truth
+    _ground_truth = read_ground_truth(gt_file)
+
+
+def evaluate(pred_file: str, n_bootstrap: int = 0, ci: float = 0.95, seed: int = 152):
+    gt_ids, gt_labels = _ground_truth
+    labels, scores = join(*read_predictions(pred_file), gt_ids, gt_labels)
+    pos_scores, neg_scores = scores[labels == 1], scores[labels == 0]
+    result = {'pred_file': pred_file, 'auc': float(rank_auc(pos_scores, neg_scores))}
+    if n_bootstrap > 0:
+        aucs = bootstrap_auc(pos_scores, neg_scores, n_bootstrap, seed)
+        low, high = np.percentile(aucs, [50 * (1 - ci), 50 * (1 + ci)])
+        result['ci'] = (float(low), float(high))
+    return result
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--pred_file', type=str, required=True)
+    parser.add_argument('--pred_file', type=str, nargs='+', required=True)
     parser.add_argument('--gt_file', type=str, required=True)
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--n_bootstrap', type=int, default=0)
+    parser.add_argument('--ci', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=152)
     args = parser.parse_args()
     return args
 
 
 def main(args):
-    pred = {}
-    gt = {}
-    with open(args.pred_file, 'r') as f:
-        for line in map(lambda x: x.split(), f.readlines()):
-            idx, score = int(line[0]), float(line[1])
-            pred[idx] = score
-    with open(args.gt_file, 'r') as f:
-        pos_nodes = list(map(int, f.readline().strip().split()))
-        for idx in pos_nodes:
-            gt[idx] = 1
-        neg_nodes = list(map(int, f.readline().strip().split()))
-        for idx in neg_nodes:
-            gt[idx] = 0
-
-    pred_arr = []
-    gt_arr = []
-    for key in pred.keys():
-        if key in gt:
-            pred_arr.append(pred[key])
-            gt_arr.append(gt[key])
-
-    print(roc_auc_score(gt_arr, pred_arr))
-    
+    jobs = [(pred_file, args.n_bootstrap, args.ci, args.seed) for pred_file in args.pred_file]
+    if args.num_workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(
+            max_workers=args.num_workers,
+            initializer=init_worker,
+            initargs=(args.gt_file,),
+        ) as executor:
+            results = list(executor.map(evaluate, *zip(*jobs)))
+    else:
+        init_worker(args.gt_file)
+        results = [evaluate(*job) for job in jobs]
+
+    # A single file without bootstrap keeps the original bare output
+    if len(results) == 1 and args.n_bootstrap == 0:
+        print(results[0]['auc'])
+        return
+    for result in results:
+        line = f"{result['pred_file']} {result['auc']:.6f}"
+        if 'ci' in result:
+            line += f" [{result['ci'][0]:.6f}, {result['ci'][1]:.6f}]"
+        print(line)
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args)
\ No newline at end of file
+    main(args)
@@ -0,0 +1,129 @@
+import os
+from typing import Optional
+
+
+import numpy as np
+
+
+EXPORT_CHUNK = 1 << 20
+OUT_FORMATS = ['text', 'npy']
+
+
+def format_chunks(fmt: str, ids: np.ndarray, scores: np.ndarray, chunk: int = EXPORT_CHUNK):
+    '''
+    Yield the lines `fmt % (id, score)` for all nodes, one string per chunk.
+    Each chunk is formatted with a single C-level % call on an interleaved
+    (id, score, id, score, ...) list instead of one f-string per node.
+    '''
+    for start in range(0, len(scores), chunk):
+        chunk_ids = ids[start:start + chunk].tolist()
+        chunk_scores = scores[start:start + chunk].tolist()
+        values = [None] * (2 * len(chunk_scores))
+        values[::2] = chunk_ids
+        values[1::2] = chunk_scores
+        yield (fmt * len(chunk_scores)) % tuple(values)
+
+
+def atomic_writer(out_file: str, mode: str = 'w'):
+    # Readers such as the bot's score index only ever see a complete file
+    tmp_file = out_file + '.tmp'
+    return tmp_file, open(tmp_file, mode)
+
+
+def write_scores_text(out_file: str, scores: np.ndarray, ids: np.ndarray = None):
+    '''
+    "<id> <score>" per line with 10 decimals, the format write_posterior has
+    always produced. ids default to the node indices.
+    '''
+    if ids is None:
+        ids = np.arange(len(scores))
+    with open(out_file, 'w') as f:
+        for text in format_chunks('%d %.10f\n', ids, scores):
+            f.write(text)
+
+
+def write_scores_npy(out_file: str, scores: np.ndarray):
+    # Raw float64 vector indexed by node; np.load(out_file, mmap_mode='r')
+    # maps it without parsing
+    np.save(out_file, np.asarray(scores, dtype=np.float64))
+
+
+def write_posterior(out_file: str, scores: np.ndarray, out_format: str = 'text', ids: np.ndarray = None):
+    assert out_format in OUT_FORMATS
+    if out_format == 'npy':
+        write_scores_npy(out_file, scores)
+    else:
+        write_scores_text(out_file, scores, ids)
+
+
+def read_id_map(id_map_file: str) -> np.ndarray:
+    '''
+    Load the Discord snowflake of every node index, either from a .npy array
+    (position = node index) or from text lines "<node index> <discord id>".
+    '''
+    if id_map_file.endswith('.npy'):
+        return np.load(id_map_file).astype(np.uint64)
+    data = np.loadtxt(id_map_file, dtype=[('node', np.int64), ('discord_id', np.uint64)], ndmin=1)
+    discord_ids = np.zeros(int(data['node'].max()) + 1 if len(data) else 0, dtype=np.uint64)
+    discord_ids[data['node']] = data['discord_id']
+    return discord_ids
+
+
+def discord_ids(id_map_file: Optional[str], id_map):
+    '''
+    Discord ID of every node index and a mask of the nodes that have one:
+    from `id_map_file` if given, where unmapped nodes are left as 0,
+    otherwise the graph's own raw node IDs (graphs built directly over
+    snowflakes), which are all known, 0 included.
+    '''
+    if id_map_file:
+        ids = read_id_map(id_map_file)
+        return ids, ids != 0
+    ids = id_map.raw_ids()
+    return ids, np.ones(len(ids), dtype=bool)
+
+
+def write_score_json(out_file: str, discord_ids: np.ndarray, scores: np.ndarray):
+    '''
+    Write {"<discord id>": score, ...} in the layout of sybil_score.json.
+    '''
+    tmp_file, f = atomic_writer(out_file)
+    with f:
+        f.write('{\n')
+        first = True
+        for text in format_chunks('    "%d": %.10g,\n', discord_ids, scores):
+            if not first:
+                f.write(',\n')
+            # The last entry of every chunk must not end with a comma in case
+            # it is the last entry of the file
+            f.write(text[:-2])
+            first = False
+        f.write('\n}' if not first else '}')
+    os.replace(tmp_file, out_file)
+
+
+def write_score_index(out_file: str, discord_ids: np.ndarray, scores: np.ndarray):
+    '''
+    Write the compact binary form the bot's SybilScoreIndex loads directly: an
+    .npz with sorted uint64 `ids` and matching float32 `scores`.
+    '''
+    order = np.argsort(discord_ids, kind='stable')
+    tmp_file, f = atomic_writer(out_file, 'wb')
+    with f:
+        np.savez(f, ids=discord_ids[order].astype(np.uint64), scores=scores[order].astype(np.float32))
+    os.replace(tmp_file, out_file)
+
+
+def write_discord_scores(out_file: str, discord_ids: np.ndarray, known: np.ndarray, scores: np.ndarray):
+    '''
+    Emit the bot's score file for every node that has a Discord ID (`known`,
+    see discord_ids): .npz for the binary index, JSON otherwise.
+    '''
+    num_nodes = min(len(discord_ids), len(scores))
+    discord_ids = discord_ids[:num_nodes]
+    known = known[:num_nodes]
+    scores = np.asarray(scores[:num_nodes], dtype=np.float64)
+    if out_file.endswith('.npz'):
+        write_score_index(out_file, discord_ids[known], scores[known])
+    else:
+        write_score_json(out_file, discord_ids[known], scores[known])
@@ -0,0 +1,172 @@
+import argparse
+import os
+from tqdm import tqdm
+
+
+import numpy as np
+
+from graph_cache import write_csr, write_edges_text
+
+
+DEGREE_DISTS = ['uniform', 'powerlaw']
+
+
+class SybilGraphGenerator:
+    '''
+    Synthetic social graph with an honest region (nodes 0..num_honest-1), a
+    Sybil region (the next num_sybil ids) and n_attack edges between them.
+    Edges inside a region are sampled in fixed-size chunks, each from its own
+    seeded RNG stream, so every chunk can be regenerated on demand and the
+    full edge list never has to be held in memory. Every undirected edge is
+    emitted in both directions; self-loops are dropped and rare duplicate
+    edges are kept.
+    '''
+    def __init__(
+            self,
+            num_honest: int,
+            num_sybil: int,
+            avg_degree_honest: float = 10.0,
+            avg_degree_sybil: float = 10.0,
+            n_attack: int = 0,
+            degree_dist: str = 'uniform',
+            powerlaw_exponent: float = 2.5,
+            chunk_edges: int = 1 << 20,
+            seed: int = 152,
+        ):
+        assert degree_dist in DEGREE_DISTS
+        self.num_honest = num_honest
+        self.num_sybil = num_sybil
+        self.degree_dist = degree_dist
+        self.powerlaw_exponent = powerlaw_exponent
+        self.seed = seed
+
+        # (offset, region size, number of undirected edges, attack?) per chunk
+        self.chunks = []
+        for offset, size, avg_degree in [
+            (0, num_honest, avg_degree_honest),
+            (num_honest, num_sybil, avg_degree_sybil),
+        ]:
+            self.add_chunks(offset, size, int(size * avg_degree / 2), chunk_edges, attack=False)
+        self.add_chunks(0, 0, n_attack, chunk_edges, attack=True)
+        self.cdfs = {}
+
+
+    @property
+    def num_nodes(self):
+        return self.num_honest + self.num_sybil
+
+
+    def add_chunks(self, offset: int, size: int, num_edges: int, chunk_edges: int, attack: bool):
+        for start in range(0, num_edges, chunk_edges):
+            self.chunks.append((offset, size, min(chunk_edges, num_edges - start), attack))
+
+
+    def sample_nodes(self, rng: np.random.Generator, size: int, k: int):
+        if self.degree_dist == 'uniform':
+            return rng.integers(0, size, k)
+        # Chung-Lu style: node i is picked with weight (i + 1)^(-1 / (gamma - 1)),
+        # which gives a power-law degree distribution with exponent gamma
+        if size not in self.cdfs:
+            weights = np.arange(1, size + 1, dtype=np.float64) ** (-1.0 / (self.powerlaw_exponent - 1))
+            cdf = np.cumsum(weights)
+            self.cdfs[size] = cdf / cdf[-1]
+        return np.minimum(np.searchsorted(self.cdfs[size], rng.random(k)), size - 1)
+
+
+    def chunk(self, i: int) -> np.ndarray:
+        offset, size, k, attack = self.chunks[i]
+        rng = np.random.default_rng([self.seed, i])
+        if attack:
+            node1 = rng.integers(0, self.num_honest, k)
+            node2 = self.num_honest + rng.integers(0, self.num_sybil, k)
+        else:
+            node1 = offset + self.sample_nodes(rng, size, k)
+            node2 = offset + self.sample_nodes(rng, size, k)
+        keep = node1 != node2
+        node1, node2 = node1[keep], node2[keep]
+        return np.concatenate([np.stack([node1, node2], axis=1), np.stack([node2, node1], axis=1)])
+
+
+    def edge_chunks(self):
+        for i in tqdm(range(len(self.chunks)), desc='generating'):
+            yield self.chunk(i)
+
+
+    def write_text(self, out_file: str):
+        with open(out_file, 'w') as f:
+            for edges in self.edge_chunks():
+                write_edges_text(f, edges)
+
+
+    def write_csr(self, cache_dir: str):
+        write_csr(self.edge_chunks, cache_dir, num_nodes=self.num_nodes)
+
+
+    def write_ground_truth(self, gt_file: str, chunk: int = 1 << 20):
+        # Line 1 lists the honest nodes, line 2 the Sybils
+        with open(gt_file, 'w') as f:
+            for start, end in [(0, self.num_honest), (self.num_honest, self.num_nodes)]:
+                for chunk_start in range(start, end, chunk):
+                    ids = np.arange(chunk_start, min(chunk_start + chunk, end))
+                    if chunk_start > start:
+                        f.write(' ')
+                    f.write(' '.join(map(str, ids.tolist())))
+                f.write('\n')
+
+
+    def write_train(self, train_file: str, n_train: int):
+        # Labeled seeds sampled from each region, in the same two-line format
+        rng = np.random.default_rng([self.seed, len(self.chunks)])
+        honest = rng.choice(self.num_honest, min(n_train, self.num_honest), replace=False)
+        sybil = self.num_honest + rng.choice(self.num_sybil, min(n_train, self.num_sybil), replace=False)
+        with open(train_file, 'w') as f:
+            f.write(' '.join(map(str, np.sort(honest).tolist())) + '\n')
+            f.write(' '.join(map(str, np.sort(sybil).tolist())) + '\n')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out_file', type=str, required=True)
+    parser.add_argument('--format', type=str, default='text', choices=['text', 'csr'])
+    parser.add_argument('--gt_file', type=str, default=None)
+    parser.add_argument('--train_file', type=str, default=None)
+    parser.add_argument('--n_train', type=int, default=100)
+    parser.add_argument('--num_honest', type=int, default=4039)
+    parser.add_argument('--num_sybil', type=int, default=4039)
+    parser.add_argument('--avg_degree_honest', type=float, default=10.0)
+    parser.add_argument('--avg_degree_sybil', type=float, default=10.0)
+    parser.add_argument('--n_attack', type=int, default=1000)
+    parser.add_argument('--degree_dist', type=str, default='uniform', choices=DEGREE_DISTS)
+    parser.add_argument('--powerlaw_exponent', type=float, default=2.5)
+    parser.add_argument('--chunk_edges', type=int, default=1 << 20)
+    parser.add_argument('--seed', type=int, default=152)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    generator = SybilGraphGenerator(
+        num_honest=args.num_honest,
+        num_sybil=args.num_sybil,
+        avg_degree_honest=args.avg_degree_honest,
+        avg_degree_sybil=args.avg_degree_sybil,
+        n_attack=args.n_attack,
+        degree_dist=args.degree_dist,
+        powerlaw_exponent=args.powerlaw_exponent,
+        chunk_edges=args.chunk_edges,
+        seed=args.seed,
+    )
+    if args.format == 'text':
+        generator.write_text(args.out_file)
+    else:
+        generator.write_csr(args.out_file)
+    if args.gt_file:
+        generator.write_ground_truth(args.gt_file)
+    if args.train_file:
+        generator.write_train(args.train_file, args.n_train)
+    print(f"Wrote {os.path.abspath(args.out_file)}: {generator.num_nodes} nodes")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
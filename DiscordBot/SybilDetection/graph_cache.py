@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+from typing import Callable, Iterable, Iterator, Optional
+from tqdm import tqdm
+
+
+import numpy as np
+
+
+# Bump whenever the on-disk layout changes so stale caches get rebuilt
+CACHE_VERSION = 2
+CACHE_SUFFIX = '.csr'
+META_FILE = 'meta.json'
+CHUNK_BYTES = 1 << 26
+
+
+class CSRGraph:
+    '''
+    A directed graph in compressed sparse row form. Neighbors of node `u` are
+    `indices[indptr[u]:indptr[u + 1]]` and `degree[u]` is its out-degree.
+    Arrays loaded from a cache are read-only memmaps. `id_map` translates
+    between node indices and the raw IDs of the source file.
+    '''
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, degree: np.ndarray, id_map: Optional['IdMap'] = None):
+        self.indptr = indptr
+        self.indices = indices
+        self.degree = degree
+        self.id_map = id_map if id_map is not None else IdMap(num_nodes=len(degree))
+
+
+    @property
+    def num_nodes(self):
+        return len(self.degree)
+
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+
+class IdMap:
+    '''
+    Maps raw 64-bit node IDs (e.g. Discord snowflakes) to the dense indices
+    0..n-1 the solvers work on. `ids[i]` is the raw ID of index i; `ids=None`
+    means the graph is already numbered 0..n-1 and every index is its own ID,
+    so dense graphs pay nothing for the mapping.
+    '''
+    def __init__(self, ids: Optional[np.ndarray] = None, num_nodes: int = 0):
+        self.ids = ids
+        self.num_nodes = num_nodes if ids is None else len(ids)
+        # Indices sorted by raw ID for lookups; ids are only unsorted after extend()
+        self._order = None
+        if ids is not None and np.any(ids[1:] < ids[:-1]):
+            self._order = np.argsort(ids, kind='stable')
+
+
+    def __len__(self):
+        return self.num_nodes
+
+
+    @property
+    def is_identity(self):
+        return self.ids is None
+
+
+    def raw_ids(self) -> np.ndarray:
+        return np.arange(self.num_nodes, dtype=np.int64) if self.ids is None else self.ids
+
+
+    def to_index(self, raw: np.ndarray) -> np.ndarray:
+        '''
+        Dense index of every raw ID in `raw`, -1 for IDs not in the graph.
+        '''
+        raw = np.asarray(raw, dtype=np.int64)
+        if self.ids is None:
+            return np.where((raw >= 0) & (raw < self.num_nodes), raw, -1)
+        sorted_ids = self.ids if self._order is None else self.ids[self._order]
+        pos = np.searchsorted(sorted_ids, raw)
+        pos[pos == len(sorted_ids)] = 0
+        found = sorted_ids[pos] == raw if len(sorted_ids) else np.zeros(raw.shape, dtype=bool)
+        index = pos if self._order is None else self._order[pos]
+        return np.where(found, index, -1)
+
+
+    def extend(self, raw: np.ndarray) -> 'IdMap':
+        '''
+        Return a map that also covers the unseen IDs in `raw`, appended after
+        the existing indices so those keep their meaning. A dense map stays
+        dense as long as the new IDs continue its 0..n-1 range.
+        '''
+        raw = np.asarray(raw, dtype=np.int64)
+        new_ids = np.unique(raw[self.to_index(raw) < 0])
+        if len(new_ids) == 0:
+            return self
+        if self.ids is None and new_ids[0] == self.num_nodes and new_ids[-1] == self.num_nodes + len(new_ids) - 1:
+            return IdMap(num_nodes=self.num_nodes + len(new_ids))
+        return IdMap(np.concatenate([self.raw_ids(), new_ids]))
+
+
+def from_edges(edges: np.ndarray, num_nodes: Optional[int] = None) -> CSRGraph:
+    '''
+    Build an in-memory CSRGraph from an (num_edges, 2) array of directed edges.
+    '''
+    if num_nodes is None:
+        num_nodes = int(edges.max()) + 1 if len(edges) else 0
+    order = np.argsort(edges[:, 0], kind='stable')
+    degree = np.bincount(edges[:, 0], minlength=num_nodes)
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(degree, out=indptr[1:])
+    index_dtype = np.int32 if num_nodes < np.iinfo(np.int32).max else np.int64
+    return CSRGraph(indptr, edges[order, 1].astype(index_dtype), degree)
+
+
+def read_edge_chunks(network_file: str, chunk_bytes: int = CHUNK_BYTES) -> Iterator[np.ndarray]:
+    '''
+    Parse a text edge list ("node1 node2" per line) into (k, 2) int64 arrays
+    of roughly `chunk_bytes` of input each, so memory stays bounded.
+    '''
+    with open(network_file, 'rb') as f:
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            # Extend the block to the end of the current line
+            block += f.readline()
+            if not block.strip():
+                # Only blank lines, which np.fromstring would read as [0]
+                continue
+            edges = np.fromstring(block, dtype=np.int64, sep=' ').reshape(-1, 2)
+            assert not np.any(edges[:, 0] == edges[:, 1])
+            yield edges
+
+
+def read_edge_delta(delta_file: str):
+    '''
+    Parse an edge-delta file with one "+ node1 node2" (add) or
+    "- node1 node2" (remove) directed edge per line. Returns the added and
+    removed edges as (k, 2) int64 arrays.
+    '''
+    edges = {'+': [], '-': []}
+    with open(delta_file, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            op, node1, node2 = fields
+            assert op in edges and node1 != node2
+            edges[op].append((int(node1), int(node2)))
+    return (
+        np.array(edges['+'], dtype=np.int64).reshape(-1, 2),
+        np.array(edges['-'], dtype=np.int64).reshape(-1, 2),
+    )
+
+
+def write_edges_text(f, edges: np.ndarray):
+    # One C-level format call per chunk instead of one write per edge
+    f.write(('%d %d\n' * len(edges)) % tuple(edges.ravel().tolist()))
+
+
+def default_cache_dir(network_file: str) -> str:
+    return network_file + CACHE_SUFFIX
+
+
+def _source_stamp(network_file: str) -> dict:
+    stat = os.stat(network_file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_meta(cache_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(cache_dir, META_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cache_valid(network_file: str, cache_dir: str) -> bool:
+    meta = _read_meta(cache_dir)
+    return (
+        meta is not None
+        and meta.get('version') == CACHE_VERSION
+        and meta.get('source') == _source_stamp(network_file)
+    )
+
+
+def _merge_sorted_unique(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # Union of two sorted unique arrays; the stable sort (timsort) merges the
+    # two runs in linear time instead of re-sorting the whole ID set
+    merged = np.concatenate([a, b])
+    merged.sort(kind='stable')
+    return merged[np.append(True, merged[1:] != merged[:-1])]
+
+
+def _count_degrees(chunks: Callable[[], Iterable[np.ndarray]], num_nodes: int):
+    '''
+    First pass of write_csr: the sorted raw IDs of all nodes and the
+    out-degree of each. Small non-negative IDs are counted in arrays indexed
+    by ID; once the IDs are too sparse for that (e.g. snowflakes) counting
+    switches to a sorted ID set merged chunk by chunk.
+    '''
+    seen = np.ones(num_nodes, dtype=bool)
+    degree = np.zeros(num_nodes, dtype=np.int64)
+    ids = None
+    for edges in tqdm(chunks(), desc='counting'):
+        if len(edges) == 0:
+            continue
+        if ids is None and edges.min() >= 0 and edges.max() < 2 * (len(seen) + edges.size):
+            size = max(len(seen), int(edges.max()) + 1)
+            if size > len(seen):
+                seen = np.pad(seen, (0, size - len(seen)))
+                degree = np.pad(degree, (0, size - len(degree)))
+            seen[edges.ravel()] = True
+            degree += np.bincount(edges[:, 0], minlength=size)
+            continue
+        if ids is None:
+            ids = np.flatnonzero(seen)
+            degree = degree[ids]
+        grown = _merge_sorted_unique(ids, np.unique(edges))
+        if len(grown) > len(ids):
+            counts = np.zeros(len(grown), dtype=np.int64)
+            counts[np.searchsorted(grown, ids)] = degree
+            ids, degree = grown, counts
+        degree += np.bincount(np.searchsorted(ids, edges[:, 0]), minlength=len(ids))
+    if ids is None:
+        ids = np.flatnonzero(seen)
+        degree = degree[ids]
+    return ids.astype(np.int64), degree
+
+
+def write_csr(
+        chunks: Callable[[], Iterable[np.ndarray]],
+        cache_dir: str,
+        source: Optional[dict] = None,
+        num_nodes: Optional[int] = None,
+    ):
+    '''
+    Write indptr.npy / indices.npy / degree.npy under `cache_dir` from a
+    stream of (k, 2) edge chunks. `chunks()` must return a fresh iterator over
+    the same edges each time it is called: the first pass counts degrees and
+    the second scatters each chunk into its rows of the on-disk indices array,
+    so peak memory is O(num_nodes + chunk) rather than O(num_edges).
+    Raw IDs that are not already 0..n-1 are compacted to dense indices in
+    sorted ID order, and the raw IDs are saved as node_ids.npy.
+    `num_nodes` adds the IDs 0..num_nodes-1 even if they have no edges.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    # Invalidate first so an interrupted build is never picked up
+    meta_path = os.path.join(cache_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    ids, degree = _count_degrees(chunks, num_nodes or 0)
+    num_nodes = len(ids)
+    # IDs that already are 0..n-1 are used as indices directly
+    id_map = IdMap(num_nodes=num_nodes) if num_nodes == 0 or (ids[0] == 0 and ids[-1] == num_nodes - 1) else IdMap(ids)
+
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(degree, out=indptr[1:])
+    index_dtype = np.int32 if num_nodes < np.iinfo(np.int32).max else np.int64
+    indices = np.lib.format.open_memmap(
+        os.path.join(cache_dir, 'indices.npy'),
+        mode='w+',
+        dtype=index_dtype,
+        shape=(int(indptr[-1]),),
+    )
+
+    # Next free slot of every row; edges keep their stream order within a row
+    cursor = indptr[:-1].copy()
+    for edges in tqdm(chunks(), desc='scattering'):
+        if len(edges) == 0:
+            continue
+        if not id_map.is_identity:
+            edges = np.searchsorted(ids, edges)
+        order = np.argsort(edges[:, 0], kind='stable')
+        src = edges[order, 0]
+        rows, first, counts = np.unique(src, return_index=True, return_counts=True)
+        rank = np.arange(len(src)) - np.repeat(first, counts)
+        indices[cursor[src] + rank] = edges[order, 1]
+        cursor[rows] += counts
+    indices.flush()
+    del indices
+
+    np.save(os.path.join(cache_dir, 'indptr.npy'), indptr)
+    np.save(os.path.join(cache_dir, 'degree.npy'), degree)
+    node_ids_path = os.path.join(cache_dir, 'node_ids.npy')
+    if not id_map.is_identity:
+        np.save(node_ids_path, ids)
+    elif os.path.exists(node_ids_path):
+        os.remove(node_ids_path)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'source': source,
+        'num_nodes': num_nodes,
+        'num_edges': int(indptr[-1]),
+    }
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def build_cache(network_file: str, cache_dir: str, chunk_bytes: int = CHUNK_BYTES):
+    '''
+    Convert a text edge list into a CSR cache stamped with the source file's
+    size and mtime.
+    '''
+    stamp = _source_stamp(network_file)
+    write_csr(lambda: read_edge_chunks(network_file, chunk_bytes), cache_dir, stamp)
+
+
+def is_cache_dir(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILE))
+
+
+def load_cache(cache_dir: str) -> CSRGraph:
+    def load(name):
+        return np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+    degree = load('degree')
+    node_ids_path = os.path.join(cache_dir, 'node_ids.npy')
+    if os.path.exists(node_ids_path):
+        id_map = IdMap(np.load(node_ids_path))
+    else:
+        id_map = IdMap(num_nodes=len(degree))
+    return CSRGraph(load('indptr'), load('indices'), degree, id_map)
+
+
+def load_graph(network_file: str, cache_dir: Optional[str] = None) -> CSRGraph:
+    '''
+    Memory-map the CSR cache of `network_file`, (re)building it first if it is
+    missing or the source file has changed since it was written.
+    `network_file` may also be a cache directory itself (e.g. one written by
+    generate_graph.py), which is loaded as is.
+    '''
+    if is_cache_dir(network_file):
+        return load_cache(network_file)
+    cache_dir = cache_dir or default_cache_dir(network_file)
+    if not is_cache_valid(network_file, cache_dir):
+        build_cache(network_file, cache_dir)
+    return load_cache(cache_dir)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--network_file', type=str, required=True)
+    parser.add_argument('--cache_dir', type=str, default=None)
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    cache_dir = args.cache_dir or default_cache_dir(args.network_file)
+    if args.force or not is_cache_valid(args.network_file, cache_dir):
+        build_cache(args.network_file, cache_dir)
+    graph = load_cache(cache_dir)
+    id_note = "" if graph.id_map.is_identity else " (raw IDs compacted)"
+    print(f"{cache_dir}: {graph.num_nodes} nodes, {graph.num_edges} edges{id_note}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -0,0 +1,183 @@
+import multiprocessing as mp
+from multiprocessing.shared_memory import SharedMemory
+import time
+from typing import Optional
+
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from convergence import is_converged
+
+
+class SharedArrays:
+    '''
+    Owns a set of named NumPy arrays backed by `multiprocessing.shared_memory`.
+    Workers re-attach to them by name through `specs`, so nothing but a few
+    strings and shapes is ever pickled.
+    '''
+    def __init__(self):
+        self.blocks = []
+        self.arrays = {}
+        self.specs = {}
+
+
+    def add(self, name: str, shape, dtype, source=None):
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = SharedMemory(create=True, size=nbytes)
+        self.blocks.append(shm)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        if source is not None:
+            array[...] = source
+        self.arrays[name] = array
+        self.specs[name] = (shm.name, shape, dtype.str)
+        return array
+
+
+    def close(self):
+        self.arrays.clear()
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks.clear()
+
+
+def attach(specs: dict):
+    blocks = []
+    arrays = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return blocks, arrays
+
+
+def partition_rows(indptr: np.ndarray, num_parts: int):
+    '''
+    Split the rows into `num_parts` contiguous ranges holding roughly the same
+    number of edges, so every worker does a similar amount of SpMV work.
+    '''
+    targets = np.linspace(0, indptr[-1], num_parts + 1)
+    bounds = np.searchsorted(indptr, targets, side='left')
+    bounds[0], bounds[-1] = 0, len(indptr) - 1
+    return np.maximum.accumulate(bounds)
+
+
+def lbp_worker(
+        specs: dict,
+        rank: int,
+        start: int,
+        end: int,
+        max_iter: int,
+        tol: Optional[float],
+        tol_norm: str,
+        barrier,
+    ):
+    # The mappings are released when the worker process exits
+    _, arrays = attach(specs)
+    indptr = arrays['indptr']
+    indices = arrays['indices']
+    num_nodes = len(indptr) - 1
+    lo, hi = indptr[start], indptr[end]
+    # Rows [start, end) as a CSR view over the shared buffers
+    local_indptr = (indptr[start:end + 1] - lo).astype(indices.dtype)
+    local_mat = csr_matrix(
+        (arrays['data'][lo:hi], indices[lo:hi], local_indptr),
+        shape=(end - start, num_nodes),
+    )
+    prior = arrays['prior'][start:end]
+    # Row 0 / 1 take turns as posterior_pre / posterior, so no copy is
+    # needed between iterations
+    buffers = arrays['buffers']
+    # history[i, rank] holds this worker's (l1, linf) residual of iteration i.
+    # Every iteration has its own slot, so no extra barrier is needed before
+    # the next iteration overwrites anything.
+    history = arrays['history']
+    iter_times = arrays['iter_times']
+    for i in range(max_iter):
+        iter_start = time.perf_counter()
+        pre = buffers[i % 2, start:end]
+        out = local_mat.dot(buffers[i % 2])
+        out += prior
+        np.clip(out, -0.5, 0.5, out=out)
+        diff = np.abs(out - pre)
+        history[i, rank] = diff.sum(), diff.max(initial=0.0)
+        buffers[(i + 1) % 2, start:end] = out
+        barrier.wait()
+        if rank == 0:
+            iter_times[i] = time.perf_counter() - iter_start
+        # All workers see the same history and reach the same decision
+        if is_converged(history[i, :, 0].sum(), history[i, :, 1].max(), tol, tol_norm):
+            break
+
+
+def run_lbp(
+        indptr,
+        indices,
+        data,
+        prior,
+        max_iter: int,
+        num_workers: int,
+        tol: Optional[float] = None,
+        tol_norm: str = 'l1',
+    ):
+    '''
+    Run up to `max_iter` Jacobi LBP iterations with `num_workers` processes,
+    each owning a contiguous range of rows. Returns (posterior, posterior_pre,
+    residuals, iter_times) where residuals holds the (l1, linf) residual of
+    every iteration that ran.
+    '''
+    num_nodes = len(prior)
+    shared = SharedArrays()
+    try:
+        shared.add('indptr', indptr.shape, np.int64, indptr)
+        shared.add('indices', indices.shape, indices.dtype, indices)
+        shared.add('data', data.shape, np.float64, data)
+        shared.add('prior', prior.shape, np.float64, prior)
+        shared.add('buffers', (2, num_nodes), np.float64)
+        shared.arrays['buffers'][0] = prior
+        shared.add('history', (max_iter, num_workers, 2), np.float64)
+        shared.add('iter_times', (max_iter,), np.float64)
+        shared.arrays['iter_times'][:] = np.nan
+
+        ctx = mp.get_context()
+        barrier = ctx.Barrier(num_workers)
+        bounds = partition_rows(indptr, num_workers)
+        workers = [
+            ctx.Process(
+                target=lbp_worker,
+                args=(
+                    shared.specs, i, int(bounds[i]), int(bounds[i + 1]),
+                    max_iter, tol, tol_norm, barrier,
+                ),
+            )
+            for i in range(num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=0.1)
+            # A dead worker would leave the others waiting on the barrier forever
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                barrier.abort()
+        if any(worker.exitcode != 0 for worker in workers):
+            raise RuntimeError("LBP worker process failed")
+
+        iter_times = shared.arrays['iter_times']
+        num_iter = int(np.count_nonzero(~np.isnan(iter_times)))
+        history = shared.arrays['history'][:num_iter]
+        residuals = np.stack([history[:, :, 0].sum(axis=1), history[:, :, 1].max(axis=1)], axis=1)
+        buffers = shared.arrays['buffers']
+        result = (
+            buffers[num_iter % 2].copy(),
+            buffers[(num_iter + 1) % 2].copy(),
+            residuals.tolist(),
+            iter_times[:num_iter].tolist(),
+        )
+        # Views must be gone before the shared blocks can be closed
+        del buffers, history, iter_times
+        return result
+    finally:
+        shared.close()
@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import time
+
+
+import numpy as np
+
+from graph_cache import CSRGraph, from_edges
+from sybilscar import SybilScar
+
+
+def synthetic_graph(num_nodes: int, avg_degree: int, seed: int) -> CSRGraph:
+    # Uniform random undirected graph, stored with both edge directions
+    rng = np.random.default_rng(seed)
+    num_edges = num_nodes * avg_degree // 2
+    node1 = rng.integers(0, num_nodes, num_edges)
+    node2 = rng.integers(0, num_nodes, num_edges)
+    keep = node1 != node2
+    node1, node2 = node1[keep], node2[keep]
+    edges = np.concatenate([np.stack([node1, node2], axis=1), np.stack([node2, node1], axis=1)])
+    return from_edges(edges, num_nodes)
+
+
+def time_lbp(graph: CSRGraph, num_workers: int, max_iter: int, num_seeds: int, seed: int, repeat: int):
+    rng = np.random.default_rng(seed)
+    solver = SybilScar(max_iter=max_iter)
+    solver.set_graph(graph)
+    seeds = rng.choice(graph.num_nodes, 2 * num_seeds, replace=False)
+    solver.prior[seeds[:num_seeds]] = solver.theta_pos - 0.5
+    solver.prior[seeds[num_seeds:]] = solver.theta_neg - 0.5
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        solver.lbp(num_workers=num_workers)
+        best = min(best, time.perf_counter() - start)
+    return best, solver.result.num_iter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_nodes', type=int, default=1000000)
+    parser.add_argument('--avg_degree', type=int, default=20)
+    parser.add_argument('--max_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max_iter', type=int, default=10)
+    parser.add_argument('--num_seeds', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=152)
+    parser.add_argument('--out_file', type=str, default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    graph = synthetic_graph(args.num_nodes, args.avg_degree, args.seed)
+    print(f"Synthetic graph: {graph.num_nodes} nodes, {graph.num_edges} edges, {os.cpu_count()} cores available")
+
+    rows = []
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8} {'efficiency':>10}")
+    for num_workers in range(1, args.max_workers + 1):
+        seconds, num_iter = time_lbp(graph, num_workers, args.max_iter, args.num_seeds, args.seed, args.repeat)
+        speedup = rows[0]['seconds'] / seconds if rows else 1.0
+        rows.append({
+            'workers': num_workers,
+            'seconds': seconds,
+            'iterations': num_iter,
+            'speedup': speedup,
+            'efficiency': speedup / num_workers,
+        })
+        print(f"{num_workers:>8} {seconds:>10.3f} {speedup:>8.2f} {speedup / num_workers:>10.2f}")
+
+    if args.out_file:
+        with open(args.out_file, 'w') as f:
+            json.dump({
+                'num_nodes': graph.num_nodes,
+                'num_edges': graph.num_edges,
+                'results': rows,
+            }, f, indent=4)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
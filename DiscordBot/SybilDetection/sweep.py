@@ -0,0 +1,100 @@
+import argparse
+import itertools
+import json
+import os
+
+
+import numpy as np
+
+from convergence import NORMS
+from sybilrank import SybilRank
+from sybilscar import SybilScar
+
+
+def sybilrank_sweep(args):
+    solver = SybilRank(
+        max_iter=args.max_iter,
+        network_file=args.network_file,
+        tol=args.tol,
+        tol_norm=args.tol_norm,
+    )
+    settings = [
+        {'train_file': train_file, 'alpha': alpha}
+        for train_file, alpha in itertools.product(args.train_file, args.alpha)
+    ]
+    # Each train file is read once even if it appears in several settings
+    priors = {train_file: solver.read_prior(train_file) for train_file in args.train_file}
+    posteriors = solver.propagate_batch(
+        np.stack([priors[setting['train_file']] for setting in settings], axis=1),
+        [setting['alpha'] for setting in settings],
+    )
+    return solver, settings, posteriors
+
+
+def sybilscar_sweep(args):
+    solver = SybilScar(
+        max_iter=args.max_iter,
+        network_file=args.network_file,
+        tol=args.tol,
+        tol_norm=args.tol_norm,
+    )
+    settings = [
+        {'train_file': train_file, 'theta_pos': theta_pos, 'theta_neg': theta_neg, 'weight': weight}
+        for train_file, theta_pos, theta_neg, weight in itertools.product(
+            args.train_file, args.theta_pos, args.theta_neg, args.weight,
+        )
+    ]
+    priors = np.stack([
+        solver.read_prior(setting['train_file'], setting['theta_pos'], setting['theta_neg'])
+        for setting in settings
+    ], axis=1)
+    posteriors = solver.lbp_batch(priors, [setting['weight'] for setting in settings])
+    return solver, settings, posteriors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Propagate every combination of the given train files and "
+                    "parameters together over one load of the graph.",
+    )
+    parser.add_argument('--solver', type=str, required=True, choices=['sybilrank', 'sybilscar'])
+    parser.add_argument('--network_file', type=str, required=True)
+    parser.add_argument('--train_file', type=str, nargs='+', required=True)
+    parser.add_argument('--out_dir', type=str, required=True)
+    parser.add_argument('--max_iter', type=int, default=10)
+    parser.add_argument('--tol', type=float, default=None)
+    parser.add_argument('--tol_norm', type=str, default='l1', choices=NORMS)
+    # SybilRank parameters
+    parser.add_argument('--alpha', type=float, nargs='+', default=[0.0])
+    # SybilScar parameters
+    parser.add_argument('--theta_pos', type=float, nargs='+', default=[0.6])
+    parser.add_argument('--theta_neg', type=float, nargs='+', default=[0.4])
+    parser.add_argument('--weight', type=float, nargs='+', default=[0.6])
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.solver == 'sybilrank':
+        solver, settings, posteriors = sybilrank_sweep(args)
+    else:
+        solver, settings, posteriors = sybilscar_sweep(args)
+    print(f"{len(settings)} settings: {solver.result.summary()}")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for k, setting in enumerate(settings):
+        setting['out_file'] = os.path.join(args.out_dir, f'posterior_{k}.txt')
+        solver.posterior = posteriors[:, k]
+        solver.write_posterior(setting['out_file'])
+    with open(os.path.join(args.out_dir, 'sweep.json'), 'w') as f:
+        json.dump({
+            'solver': args.solver,
+            'network_file': args.network_file,
+            'settings': settings,
+            'convergence': solver.result.to_dict(),
+        }, f, indent=4)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -1,13 +1,20 @@
 import argparse
-from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
+import json
 import math
 import random
+import time
 from typing import Optional
 from tqdm import tqdm
 
 
 import numpy as np
+from scipy.sparse import csr_matrix
+
+from convergence import NORMS, ConvergenceResult, iteration_budget, residuals
+import export
+from graph_cache import CSRGraph, IdMap, load_graph
+from parallel_lbp import run_lbp
 
 
 class SybilScar:
@@ -20,14 +27,23 @@ class SybilScar:
             max_iter: int = 10,
             network_file: Optional[str] = None,
             train_file: Optional[str] = None,
+            tol: Optional[float] = None,
+            tol_norm: str = 'l1',
         ):
         self.theta_pos = theta_pos
         self.theta_neg = theta_neg
         self.theta_unl = theta_unl
         self.weight = weight
         self.max_iter = max_iter
+        self.tol = tol
+        self.tol_norm = tol_norm
+        self.result = None
 
-        self.network_map = defaultdict(list)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.degree = np.zeros(0, dtype=np.int64)
+        self.id_map = IdMap()
+        self.adj_mat = None
         if network_file:
             self.read_network(network_file)
         self.prior = np.zeros(self.num_nodes)
@@ -37,11 +53,15 @@ class SybilScar:
 
 
     def read_network(self, network_file: str):
-        with open(network_file, 'r') as f:
-            for line in tqdm(f):
-                node1, node2 = map(int, line.strip().split())
-                assert node1 != node2
-                self.network_map[node1].append((node2, self.weight - 0.5))
+        self.set_graph(load_graph(network_file))
+
+
+    def set_graph(self, graph: CSRGraph):
+        self.indptr = graph.indptr
+        self.indices = graph.indices
+        self.degree = graph.degree
+        self.id_map = graph.id_map
+        self.adj_mat = None
         self.posterior = np.zeros(self.num_nodes)
         self.posterior_pre = np.zeros(self.num_nodes)
         self.prior = np.zeros(self.num_nodes)
@@ -49,40 +69,125 @@ class SybilScar:
 
     @property
     def num_nodes(self):
-        return len(self.network_map)
+        return len(self.degree)
     
 
-    def set_prior(self, train_file: str):
+    def read_prior(self, train_file: str, theta_pos: Optional[float] = None, theta_neg: Optional[float] = None):
+        theta_pos = self.theta_pos if theta_pos is None else theta_pos
+        theta_neg = self.theta_neg if theta_neg is None else theta_neg
+        prior = np.zeros(self.num_nodes)
         with open(train_file, 'r') as f:
-            pos_train_nodes = list(map(int, f.readline().strip().split()))
-            for node in pos_train_nodes:
-                self.prior[node] = self.theta_pos - 0.5
-            neg_train_nodes = list(map(int, f.readline().strip().split()))
-            for node in neg_train_nodes:
-                self.prior[node] = self.theta_neg - 0.5
+            pos_train_nodes = self.to_index(np.array(f.readline().split(), dtype=np.int64))
+            prior[pos_train_nodes] = theta_pos - 0.5
+            neg_train_nodes = self.to_index(np.array(f.readline().split(), dtype=np.int64))
+            prior[neg_train_nodes] = theta_neg - 0.5
+        return prior
+
+
+    def to_index(self, nodes: np.ndarray) -> np.ndarray:
+        # Raw node IDs to graph indices; labeled nodes missing from the graph
+        # are dropped
+        index = self.id_map.to_index(nodes)
+        return index[index >= 0]
+
+
+    def set_prior(self, train_file: str):
+        self.prior = self.read_prior(train_file)
 
 
-    def write_posterior(self, out_file: str):
-        with open(out_file, 'w') as f:
-            for i in range(self.num_nodes):
-                f.write(f"{i} {self.posterior[i] + 0.5:.10f}\n")
+    def write_posterior(self, out_file: str, out_format: str = 'text'):
+        export.write_posterior(out_file, self.posterior + 0.5, out_format, self.id_map.raw_ids())
+
+
+    def get_adj_mat(self):
+        # Every edge carries the same coupling 2 * (weight - 0.5), stored in
+        # the CSR data array so that one SpMV computes all neighbor sums
+        data = np.full(len(self.indices), 2 * (self.weight - 0.5))
+        return csr_matrix((data, self.indices, self.indptr), shape=(self.num_nodes, self.num_nodes))
 
 
     def lbp_thread(self, start, end):
         for index in range(start, end):
             node = self.ordering_array[index]
-            self.posterior[node] = sum(2 * self.posterior_pre[nei[0]] * nei[1] for nei in self.network_map[node])
+            neighbors = self.indices[self.indptr[node]:self.indptr[node + 1]]
+            self.posterior[node] = 2 * (self.weight - 0.5) * self.posterior_pre[neighbors].sum()
             self.posterior[node] += self.prior[node]
             self.posterior[node] = min(0.5, max(-0.5, self.posterior[node]))
 
-    def lbp(self, num_threads: int = 1):
-        if math.log(self.num_nodes) < self.max_iter:
-            self.max_iter = int(math.log(self.num_nodes))
+    def lbp_sparse(self, max_iter: int):
+        # Same Jacobi update as lbp_thread, applied to all nodes at once:
+        # posterior = clip(A @ posterior_pre + prior, -0.5, 0.5)
+        # Built on first use and kept until the graph changes
+        if self.adj_mat is None:
+            self.adj_mat = self.get_adj_mat()
+        adj_mat = self.adj_mat
+        for _ in tqdm(range(max_iter)):
+            iter_start = time.perf_counter()
+            np.copyto(self.posterior_pre, self.posterior)
+            self.posterior = adj_mat.dot(self.posterior_pre)
+            self.posterior += self.prior
+            np.clip(self.posterior, -0.5, 0.5, out=self.posterior)
+            l1, linf = residuals(self.posterior_pre, self.posterior)
+            if self.result.record(l1, linf, time.perf_counter() - iter_start):
+                break
+
+    def lbp_parallel(self, max_iter: int, num_workers: int):
+        # Worker processes share the CSR arrays and the posterior vectors
+        # through shared memory and synchronize on a barrier every iteration
+        data = np.full(len(self.indices), 2 * (self.weight - 0.5))
+        self.posterior, self.posterior_pre, history, iter_times = run_lbp(
+            self.indptr, self.indices, data, self.prior, max_iter, num_workers,
+            tol=self.tol, tol_norm=self.tol_norm,
+        )
+        for (l1, linf), seconds in zip(history, iter_times):
+            self.result.record(l1, linf, seconds)
+
+    def lbp_batch(self, priors: np.ndarray, weights):
+        '''
+        Run sparse LBP for K settings at once. `priors` is (num_nodes, K) and
+        `weights` is a scalar or one edge weight per column. Since every edge
+        shares one weight, the columns only differ by a per-column coupling
+        applied after a single SpMM with the unweighted adjacency matrix.
+        Returns the (num_nodes, K) posteriors (centered at 0, like self.posterior).
+        '''
+        priors = np.asarray(priors, dtype=np.float64).reshape(self.num_nodes, -1)
+        coupling = 2 * (np.broadcast_to(np.asarray(weights, dtype=np.float64), (priors.shape[1],)) - 0.5)
+        max_iter = iteration_budget(self.max_iter, self.num_nodes, self.tol)
+        self.result = ConvergenceResult(max_iter, self.tol, self.tol_norm)
+
+        adj_mat = csr_matrix(
+            (np.ones(len(self.indices)), self.indices, self.indptr),
+            shape=(self.num_nodes, self.num_nodes),
+        )
+        posteriors = priors.copy()
+        for _ in tqdm(range(max_iter)):
+            iter_start = time.perf_counter()
+            x = adj_mat @ posteriors
+            x *= coupling
+            x += priors
+            np.clip(x, -0.5, 0.5, out=x)
+            l1, linf = residuals(posteriors, x)
+            posteriors = x
+            if self.result.record(l1, linf, time.perf_counter() - iter_start):
+                break
+        return posteriors
+
+    def lbp(self, num_threads: int = 1, mode: str = 'sparse', num_workers: int = 1):
+        max_iter = iteration_budget(self.max_iter, self.num_nodes, self.tol)
+        self.result = ConvergenceResult(max_iter, self.tol, self.tol_norm)
         
         self.ordering_array = np.arange(self.num_nodes)
         np.copyto(self.posterior, self.prior)
 
-        for _ in tqdm(range(self.max_iter)):
+        if num_workers > 1:
+            self.lbp_parallel(max_iter, num_workers)
+            return
+        if mode == 'sparse':
+            self.lbp_sparse(max_iter)
+            return
+
+        for _ in tqdm(range(max_iter)):
+            iter_start = time.perf_counter()
             np.copyto(self.posterior_pre, self.posterior)
             random.shuffle(self.ordering_array)
 
@@ -95,6 +200,9 @@ class SybilScar:
                     futures.append(executor.submit(self.lbp_thread, start, end))
                 for future in futures:
                     future.result()
+            l1, linf = residuals(self.posterior_pre, self.posterior)
+            if self.result.record(l1, linf, time.perf_counter() - iter_start):
+                break
 
 
 def parse_args():
@@ -108,6 +216,22 @@ def parse_args():
     parser.add_argument('--theta_unl', type=float, default=0.5)
     parser.add_argument('--weight', type=float, default=0.6)
     parser.add_argument('--num_threads', type=int, default=1)
+    parser.add_argument('--num_workers', type=int, default=1)
+    # Without --tol the solver runs min(max_iter, log(num_nodes)) iterations;
+    # with it, --max_iter is a hard cap and iteration stops once the residual
+    # between successive posteriors drops below tol
+    parser.add_argument('--tol', type=float, default=None)
+    parser.add_argument('--tol_norm', type=str, default='l1', choices=NORMS)
+    parser.add_argument('--convergence_file', type=str, default=None)
+    parser.add_argument('--mode', type=str, default='sparse', choices=['sparse', 'loop'])
+    # Posterior output: one "<node> <score>" line per node, or a raw .npy
+    # vector indexed by node
+    parser.add_argument('--out_format', type=str, default='text', choices=export.OUT_FORMATS)
+    # Also write the bot's Discord ID -> score file (.npz for the binary
+    # index, JSON otherwise). Node IDs are taken as Discord IDs unless
+    # --id_map_file maps node indices to Discord IDs
+    parser.add_argument('--score_file', type=str, default=None)
+    parser.add_argument('--id_map_file', type=str, default=None)
     args = parser.parse_args()
     return args
 
@@ -123,9 +247,18 @@ def main(args):
         max_iter=args.max_iter,
         network_file=args.network_file,
         train_file=args.train_file,
+        tol=args.tol,
+        tol_norm=args.tol_norm,
     )
-    solver.lbp(num_threads=args.num_threads)
-    solver.write_posterior(args.out_file)
+    solver.lbp(num_threads=args.num_threads, mode=args.mode, num_workers=args.num_workers)
+    print(solver.result.summary())
+    if args.convergence_file:
+        with open(args.convergence_file, 'w') as f:
+            json.dump(solver.result.to_dict(), f, indent=4)
+    solver.write_posterior(args.out_file, args.out_format)
+    if args.score_file:
+        ids, known = export.discord_ids(args.id_map_file, solver.id_map)
+        export.write_discord_scores(args.score_file, ids, known, solver.posterior + 0.5)
 
 
 if __name__ == "__main__":
@@ -6,16 +6,21 @@ import json
 import logging
 import re
 import requests
-from report import Report
+from report import Report, ReportCase
 import pdb
 import asyncio
 from collections import OrderedDict
-import heapq
-import datetime
+import io
 import random
 from utils import visualize_heap
-from openai import OpenAI
-from googleapiclient import discovery
+from score_index import SybilScoreIndex
+from classifiers import BATCH_ANSWER_FORMAT, PERSPECTIVE_URL, ClassifierError, LLMBatcher, ModerationClassifier
+from classification_cache import ClassificationCache
+from report_scheduler import ReportScheduler
+from report_store import ReportStore
+from timer_queue import TimerQueue
+from prefilter import Prefilter
+import outbound
 
 
 # Set up logging to the console
@@ -27,6 +32,42 @@ logger.addHandler(handler)
 
 # Placeholdler name for json file of precomputed SybilRank scores for each Discord ID
 sybilrank_scores_file = 'SybilDetection/sybil_score.json'
+# How often (in seconds) to check the score file for a new version
+sybilrank_reload_interval = 60
+# Classifications of reported content are reused for duplicate reports,
+# and kept across restarts in this file
+classification_cache_file = 'classification_cache.json'
+classification_cache_size = 10000
+classification_cache_ttl = 24 * 3600
+# Reports are handled by this many concurrent workers; reporting waits while
+# the queue holds max_pending_reports cases
+report_workers = 4
+max_pending_reports = 1000
+# How long (in seconds) shutdown waits for the workers to drain the queue
+report_drain_timeout = 30
+# Reports classified within llm_batch_window seconds of each other share one
+# LLM request of up to llm_batch_size posts
+llm_batch_window = 0.05
+llm_batch_size = 8
+# Local pre-filter in front of the remote classifiers: messages scoring at
+# most the clear threshold stay local, the rest are escalated. The n-gram
+# model is trained with `python prefilter.py --data ...`
+prefilter_model_file = 'prefilter_model.json'
+prefilter_clear_threshold = 0.2
+prefilter_flag_threshold = 0.8
+# Messages to the mod channel are rate limited to outbound_rate per second,
+# in bursts of at most outbound_burst (Discord allows 5 per 5 seconds)
+outbound_rate = 1.0
+outbound_burst = 5
+# Open cases and appeals are kept in this SQLite database across restarts
+report_store_file = 'reports.db'
+# How long (in seconds) a decided appeal thread stays open before it is deleted
+appeal_thread_close_delay = 10
+# Typing this in the mod channel lists the first queue_dashboard_size queued cases
+queue_keyword = 'queue'
+queue_dashboard_size = 10
+# Reports queued within this many seconds of each other share one heap image
+heap_image_delay = 2
 
 # There should be a file called 'tokens.json' inside the same folder as this file
 token_path = 'tokens.json'
@@ -38,9 +79,62 @@ with open(token_path) as f:
     discord_token = tokens['discord']
     openai_api_key = tokens['openai']
     perspective_api_key = tokens['perspective']
+    # Optional overrides, e.g. to point the classifiers at local stand-in servers
+    openai_base_url = tokens.get('openai_base_url')
+    perspective_url = tokens.get('perspective_url', PERSPECTIVE_URL)
 
 
 class ModBot(discord.Client):
+    # Instructions and examples shared by the single and batched classification prompts
+    CLASSIFICATION_GUIDE = """### Instructions:
+
+        Please classify the following post based on its content. Determine whether it falls under "immediate harm" or "suggestive harm" according to the criteria outlined in the Reporting Guide. Use the definitions below to make your classification:
+
+        Immediate Harm: Content that poses an urgent and direct threat to individuals' safety and well-being, requiring immediate action. This includes:
+
+        - Violence: Terrorism, threats, glorification of violence, graphic violence, self-harm (including suicidal content and promotion of drug abuse).
+        - Sexual: Explicit sexual activity, nudity, explicit text, sexual violence.
+        - Harassment: Bullying, child abuse (including personal attacks, cyberstalking, targeting, grooming, physical, and emotional abuse).
+        - Copyright: Plagiarism, defamation, counterfeit, privacy issues.
+
+
+        Suggestive Harm: Content that indirectly or potentially poses a threat or contributes to harmful situations but may not require immediate action. This includes:
+
+        - Misleading: Clickbait, scams, manipulated media (deep fake, edited, misattributed, out of context), hoaxes.
+        - Inflammatory: Hate speech, polarizing content, sensationalism, cultural insensitivity (including appropriation, stereotypes, symbols, and gestures).
+
+        ### Examples:
+
+        Post 1:
+        "Join our cause! Let's fight back against the oppressors with any means necessary. #RevolutionNow"
+        Classification: Immediate Harm (Violence - Threats)
+
+        Post 2:
+        "Check out this amazing new product! Only $1 for a limited time! [link] #Discount #Sale"
+        Classification: Suggestive Harm (Misleading - Clickbait)
+
+        Post 3:
+        "Happy to share my latest artwork, even though someone else is trying to sell it as an NFT without my permission. #ArtTheft"
+        Classification: Suggestive Harm (Copyright - Plagiarism)
+
+        Post 4:
+        "Everyone should just end it all. Life is meaningless. #Suicide"
+        Classification: Immediate Harm (Violence - Self-Harm)
+
+        Post 5:
+        "This is what they don’t want you to see! [edited video] #Conspiracy"
+        Classification: Suggestive Harm (Misleading - Manipulated Media - Edited)
+
+        Post 6:
+        "You're such a loser, no one likes you. Just disappear. #Bullying"
+        Classification: Immediate Harm (Harassment - Bullying)
+
+        Post 7:
+        "This group of people is ruining our country. We need to get rid of them. #HateSpeech"
+        Classification: Immediate Harm (Inflammatory - Hate Speech)
+
+        """
+
     def __init__(self): 
         intents = discord.Intents.default()
         intents.message_content = True
@@ -49,22 +143,150 @@ class ModBot(discord.Client):
         self.mod_channels = {} # Map from guild to the mod channel id for that guild
         self.reports = {} # Map from user IDs to the state of their report
 
-        # A queue to handle reports of both harm types
-        self.report_queue = []
-        # Create dummy reports at initialization for demo purposes
-        for _ in range(1):
-            heapq.heappush(
-                self.report_queue,
-                (random.random(), datetime.datetime.now(), None),
-            )
+        # A queue to handle reports of both harm types, worked on by a pool
+        # of workers that wake up as soon as a report is queued
+        self.report_scheduler = ReportScheduler(
+            self.handle_case,
+            num_workers=report_workers,
+            max_pending=max_pending_reports,
+        )
+        self.report_queue = self.report_scheduler.queue
+        # Cases not resolved yet, keyed by (guild, channel, message id), so
+        # reports of a message that is already queued join its case
+        self.open_cases = {}
+        # Cases queued since the last heap image, highlighted in the next one
+        self.heap_image_cases = []
+        self.heap_image_task = None
         # A queue to handle reports of suggestive harms
         self.suggestive_harm_dict = OrderedDict()
+        # Map from mod channel review message ids to their appeal thread ids
+        self.review_messages = {}
+        # Rate-limited, prioritized sending to the mod channels
+        self.outbound = outbound.OutboundScheduler(rate=outbound_rate, burst=outbound_burst)
+        # Delayed work, such as deleting appeal threads once decided
+        self.timers = TimerQueue()
+        # SybilRank scores, loaded once and hot-swapped when the file changes
+        self.sybil_scores = SybilScoreIndex(sybilrank_scores_file)
+        # Pooled LLM and Perspective clients shared by all reports
+        self.classifier = ModerationClassifier(
+            openai_api_key,
+            perspective_api_key,
+            openai_base_url=openai_base_url,
+            perspective_url=perspective_url,
+        )
+        self.llm_batcher = LLMBatcher(
+            self.classifier.complete,
+            self.generate_batch_prompt,
+            window=llm_batch_window,
+            max_size=llm_batch_size,
+        )
+        self.classification_cache = ClassificationCache(
+            max_size=classification_cache_size,
+            ttl=classification_cache_ttl,
+            path=classification_cache_file,
+        )
+        self.report_store = ReportStore(report_store_file)
+        self.prefilter = Prefilter(
+            model_path=prefilter_model_file,
+            clear_threshold=prefilter_clear_threshold,
+            flag_threshold=prefilter_flag_threshold,
+        )
 
     async def setup_hook(self):
         '''
-        Setup a background task.
+        Setup background tasks.
+        '''
+        await self.classifier.start()
+        await self.restore_cases()
+        self.report_store.start()
+        self.timers.start()
+        self.score_reload_task = self.loop.create_task(self.reload_sybil_scores())
+
+    async def close(self):
+        await self.report_scheduler.stop(timeout=report_drain_timeout)
+        if self.heap_image_task is not None:
+            self.heap_image_task.cancel()
+        # Close the appeal threads still waiting to be deleted
+        await self.timers.stop()
+        await self.outbound.stop(timeout=report_drain_timeout)
+        await asyncio.to_thread(self.report_store.close)
+        await self.classifier.close()
+        await asyncio.to_thread(self.classification_cache.save)
+        await super().close()
+
+    async def restore_cases(self):
+        '''
+        Reload the open cases saved before the last shutdown: queued cases go
+        back into the report queue in their original order, cases waiting for
+        an appeal go back to the appeal threads. Nothing else runs yet, so
+        the cases and the heap are built in a worker thread. The reported
+        messages are only fetched again, and the stored reports only read
+        back, when a case is handled.
+        '''
+        queued, appeals = await asyncio.to_thread(self.build_restored_cases)
+        if queued or appeals:
+            logger.info(f'Restored {queued} queued cases and {appeals} appeals')
+
+    def build_restored_cases(self):
+        queued = []
+        appeals = {}
+        for row in self.report_store.load():
+            case = ReportCase.restore(row)
+            self.open_cases[case.key] = case
+            state, thread_id = row[4], row[5]
+            if state == 'appeal':
+                case.in_review = True
+                appeals[case.store_id] = (case, thread_id)
+                # The thread is looked up when the author or a moderator uses it
+                self.suggestive_harm_dict[thread_id] = (None, case)
+            else:
+                queued.append(case)
+        self.report_queue.load((case.key, case, case.stored_score) for case in queued)
+        # Moderators can still decide on the review messages sent before the restart
+        for message_id, case_id in self.report_store.load_review_messages():
+            if case_id in appeals:
+                case, thread_id = appeals[case_id]
+                self.review_messages[message_id] = thread_id
+                case.review_message_ids += (message_id,)
+        return len(queued), len(appeals)
+
+    async def load_case_reports(self, case):
+        '''
+        Read back the stored reports of a restored case, once.
+        '''
+        if not case.stored:
+            return
+        # Only the reports stored before the restart; later ones are in memory
+        rows = await asyncio.to_thread(self.report_store.load_reports, case.store_id, case.stored)
+        if case.stored:
+            case.load_stored(rows, self)
+
+    async def fetch_case_message(self, case):
+        '''
+        Fetch the reported message and the stored reports of a restored
+        case. Returns False if the message no longer exists.
+        '''
+        if case.message is None:
+            _, channel_id, message_id = case.key
+            try:
+                channel = self.get_channel(channel_id) or await self.fetch_channel(channel_id)
+                case.message = await channel.fetch_message(message_id)
+            except (discord.NotFound, discord.Forbidden):
+                return False
+        await self.load_case_reports(case)
+        for report in case.reports:
+            if report.message is None:
+                report.message = case.message
+        return True
+
+    async def reload_sybil_scores(self):
         '''
-        self.bg_task = self.loop.create_task(self.handle_report())
+        A background task that picks up a new score file without a restart.
+        Parsing happens in a worker thread so the event loop is never blocked.
+        '''
+        while not self.is_closed():
+            await asyncio.sleep(sybilrank_reload_interval)
+            await asyncio.to_thread(self.sybil_scores.reload)
     
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
@@ -87,6 +309,9 @@ class ModBot(discord.Client):
                     # A temporary fix to directly access guild id
                     # TODO: Access this info from Report
                     self.guild_id = guild.id
+
+        # Start handling reports now that the mod channels are known
+        self.report_scheduler.start()
         
 
     async def on_message(self, message):
@@ -144,22 +369,105 @@ class ModBot(discord.Client):
             if report.report_description is None:
                 return
             # Otherwise, add it to the report queue
+            await self.queue_report(report)
+
+    async def queue_report(self, report):
+        '''
+        Add a completed report to the queue. A report of a message that
+        already has an open case joins that case instead, and the case moves
+        up by the combined trust of its reporters.
+        '''
+        key = ReportCase.key_of(report.message)
+        case = self.open_cases.get(key)
+        if case is not None and case.stored:
+            # A restored case; its stored reports go ahead of the new one
+            await self.load_case_reports(case)
+            # The case may have been closed meanwhile
+            case = self.open_cases.get(key)
+        if case is not None:
+            score = self.get_sybilrank_score(report)
+            case.add(report, score)
+            self.report_store.add_report(case.store_id, report, score, case.combined_score())
+            if case.message is None:
+                # A restored case gets its message back from the new report
+                case.message = report.message
+            if case.in_review:
+                # Already being moderated; the reporter hears the outcome with the others
+                return
+            self.update_case_priority(case)
+            notice = f"Another report of a queued message has been merged into its case ({case.num_reports} reports)."
+        else:
+            score = self.get_sybilrank_score(report)
+            case = ReportCase(report, score)
+            self.open_cases[key] = case
+            case.store_id = self.report_store.add_case(key, report, score, case.combined_score())
             # Reports with lower SybilRank scores are given higher priority
             # For those with the same score, priority is determined on a first-come, first-serve basis
-            heapq.heappush(
-                self.report_queue,
-                (self.get_sybilrank_score(report), datetime.datetime.now(), report)
-            )
-            vis_filename = visualize_heap(self.report_queue, highlight_report=report)
-            mod_channel = self.mod_channels[self.guild_id]
-            await mod_channel.send(
-                "=============================\n"
-                "A report has been added to the queue. " +
-                "Based on its Sybil score, it is currently positioned at this location in the heap:\n" +
-                "(the lower the score, more trustworthy the reporter is, and the higher the priority of the report)"
+            score = case.combined_score()
+            # Waits while the queue is full
+            await self.report_scheduler.put(case.key, case, score)
+            if score != case.combined_score():
+                # Other reporters joined while waiting for space
+                self.update_case_priority(case)
+            notice = "A report has been added to the queue."
+        mod_channel = self.mod_channels[self.guild_id]
+        self.outbound.send(mod_channel, "=============================\n" + notice, priority=outbound.LOW)
+        self.heap_image_cases.append(case)
+        if self.heap_image_task is None or self.heap_image_task.done():
+            self.heap_image_task = asyncio.create_task(self.send_heap_image())
+
+    async def send_heap_image(self):
+        '''
+        Show the moderators where the recently queued cases sit in the heap.
+        Waits heap_image_delay seconds first so a burst of reports gets one
+        image, and renders it in a worker thread straight to memory. Runs
+        until no case is waiting for an image.
+        '''
+        # Cases queued while an image renders get the next one
+        while self.heap_image_cases:
+            await asyncio.sleep(heap_image_delay)
+            cases, self.heap_image_cases = self.heap_image_cases, []
+            # Cases already taken by a worker are no longer in the heap
+            highlight = [self.report_queue.position(case.key) for case in cases if case.key in self.report_queue]
+            if not highlight:
+                continue
+            dot = visualize_heap(self.report_queue.heap_view(), highlight=highlight)
+            try:
+                png = await asyncio.to_thread(dot.pipe, format='png')
+            except Exception as e:
+                logger.warning(f'Could not render the report heap: {e}')
+                continue
+            self.outbound.send(
+                self.mod_channels[self.guild_id],
+                "Based on their Sybil scores, the new reports are currently positioned at these locations in the heap:\n" +
+                "(the lower the score, more trustworthy the reporter is, and the higher the priority of the report)",
+                priority=outbound.LOW,
+                file=discord.File(io.BytesIO(png), filename='report_heap.png'),
             )
-            await mod_channel.send(file=discord.File(vis_filename))
-            os.remove(vis_filename)
+
+    def update_case_priority(self, case):
+        # Only ever lowers the score, so the case can only move up. Does
+        # nothing if the case is not in the queue yet (waiting for space)
+        self.report_scheduler.update(case.key, case.combined_score())
+
+    async def resolve_case(self, case, outcome):
+        '''
+        Close a case and tell every reporter the outcome.
+        '''
+        self.open_cases.pop(case.key, None)
+        # The reporters of a restored case are in its stored reports
+        await self.load_case_reports(case)
+        self.report_store.remove_case(case.store_id)
+        await asyncio.gather(*[
+            self.notify_reporter(reporter_id, case, outcome) for reporter_id in case.reporter_ids
+        ])
+
+    async def notify_reporter(self, reporter_id, case, outcome):
+        try:
+            user = self.get_user(reporter_id) or await self.fetch_user(reporter_id)
+            await user.send(f'Update on your report of {case.jump_url}: {outcome}')
+        except discord.HTTPException as e:
+            logger.warning(f'Could not notify reporter {reporter_id}: {e}')
 
 
     def get_sybilrank_score(self, report):
@@ -167,116 +475,66 @@ class ModBot(discord.Client):
         # Milestone 2: randomly assign a number as score
         # Milestone 3: Search for reporter's ID (same as author ID?)
         # and return SybilRank score
-        
-        with open(sybilrank_scores_file) as f:
-            scores = json.load(f)
-            if str(report.reporter_id) in scores:
-                return scores[str(report.reporter_id)]
-            else:
-                # not sure what to do here
-                return random.random()
+        score = self.sybil_scores.get(report.reporter_id)
+        if score is None:
+            # not sure what to do here
+            return random.random()
+        return score
     
     def generate_prompt(self, post):
-        PROMPT = """### Instructions:
-
-        Please classify the following post based on its content. Determine whether it falls under "immediate harm" or "suggestive harm" according to the criteria outlined in the Reporting Guide. Use the definitions below to make your classification:
-
-        Immediate Harm: Content that poses an urgent and direct threat to individuals' safety and well-being, requiring immediate action. This includes:
-
-        - Violence: Terrorism, threats, glorification of violence, graphic violence, self-harm (including suicidal content and promotion of drug abuse).
-        - Sexual: Explicit sexual activity, nudity, explicit text, sexual violence.
-        - Harassment: Bullying, child abuse (including personal attacks, cyberstalking, targeting, grooming, physical, and emotional abuse).
-        - Copyright: Plagiarism, defamation, counterfeit, privacy issues.
-
-
-        Suggestive Harm: Content that indirectly or potentially poses a threat or contributes to harmful situations but may not require immediate action. This includes:
-
-        - Misleading: Clickbait, scams, manipulated media (deep fake, edited, misattributed, out of context), hoaxes.
-        - Inflammatory: Hate speech, polarizing content, sensationalism, cultural insensitivity (including appropriation, stereotypes, symbols, and gestures).
-
-        ### Examples:
-
-        Post 1:
-        "Join our cause! Let's fight back against the oppressors with any means necessary. #RevolutionNow"
-        Classification: Immediate Harm (Violence - Threats)
-
-        Post 2:
-        "Check out this amazing new product! Only $1 for a limited time! [link] #Discount #Sale"
-        Classification: Suggestive Harm (Misleading - Clickbait)
-
-        Post 3:
-        "Happy to share my latest artwork, even though someone else is trying to sell it as an NFT without my permission. #ArtTheft"
-        Classification: Suggestive Harm (Copyright - Plagiarism)
-
-        Post 4:
-        "Everyone should just end it all. Life is meaningless. #Suicide"
-        Classification: Immediate Harm (Violence - Self-Harm)
-
-        Post 5:
-        "This is what they don’t want you to see! [edited video] #Conspiracy"
-        Classification: Suggestive Harm (Misleading - Manipulated Media - Edited)
-
-        Post 6:
-        "You're such a loser, no one likes you. Just disappear. #Bullying"
-        Classification: Immediate Harm (Harassment - Bullying)
-
-        Post 7:
-        "This group of people is ruining our country. We need to get rid of them. #HateSpeech"
-        Classification: Immediate Harm (Inflammatory - Hate Speech)
-
-        Post: {post}
+        PROMPT = """Post: {post}
         
         Answer using the following format:
         Classification: THIS POST IS A SUGGESTIVE HARM
         Explanation: [Your explanation here]"""
 
-        return PROMPT.format(post=post)      
+        return self.CLASSIFICATION_GUIDE + PROMPT.format(post=post)
+
+    def generate_batch_prompt(self, posts):
+        # The same instructions, then every post as a numbered JSON string
+        prompt = self.CLASSIFICATION_GUIDE + 'Posts:\n'
+        for i, post in enumerate(posts, 1):
+            prompt += f'        Post {i}: {json.dumps(post, ensure_ascii=False)}\n'
+        return prompt + '\n        ' + BATCH_ANSWER_FORMAT      
     
     async def is_immediate_harm(self, report):
-        # Use OpenAI to classify the content
-        client = OpenAI(api_key=openai_api_key)
-        response_4o = client.chat.completions.create(
-            # temperature
-            # The temperature of the sampling distribution. Must be strictly positive.
-            temperature=0.0,
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "Your job is to classify the following post based on its content. Determine whether it falls under 'immediate harm' or 'suggestive harm' according to the criteria outlined in the Reporting Guide. Use the definitions below to make your classification:",
-                },
-                {"role": "user", "content": self.generate_prompt(report.message.content)},
-            ],
-        ).choices[0].message.content
-
-        client = discovery.build(
-            "commentanalyzer",
-            "v1alpha1",
-            developerKey=perspective_api_key,
-            discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-            static_discovery=False,
-        )
-
-        analyze_request = {
-            'comment': { 'text': 'friendly greetings from python' },
-            'requestedAttributes': {'TOXICITY': {}}
-        }
-
-        response_pers = client.comments().analyze(body=analyze_request).execute()
-        perspective_score = response_pers["attributeScores"]["TOXICITY"]["summaryScore"]["value"]
-
-        classification = re.search(r'Classification: (.+)', response_4o).group(1)
-        explanation = re.search(r'Explanation: (.+)', response_4o).group(1)
-
+        # Classify the content with the LLM and score its toxicity with
+        # Perspective, both concurrently and without blocking the event loop.
+        # Duplicate reports of the same content reuse the cached result
+        content = report.message.content
+        # Content the local pre-filter clears never reaches the remote classifiers
+        prefiltered = self.prefilter.score(content)
+        logger.debug(f'Prefilter: {self.prefilter.stats()}')
+        if not prefiltered.escalate():
+            report.moderator_category = prefiltered.category
+            report.moderator_decision_explanation = f'Cleared by the local pre-filter (risk {prefiltered.risk:.2f})'
+            return False
+        try:
+            result = await self.classification_cache.get_or_classify(
+                content,
+                report.category,
+                lambda: self.classifier.classify(self.generate_prompt(content), content, batcher=self.llm_batcher),
+            )
+        except ClassifierError as e:
+            # Without an automatic decision the report goes to human review
+            logger.warning(f'Could not classify report: {e}')
+            return False
+        logger.debug(f'Classification cache: {self.classification_cache.stats()}, LLM batches: {self.llm_batcher.stats()}')
+        classification = result.category
+        perspective_score = result.toxicity
 
         report.moderator_4o_category = classification
-        report.moderator_4o_decision_explanation = explanation
+        report.moderator_4o_decision_explanation = result.explanation
         report.moderator_perspective_score = perspective_score
 
         if report.category == 'Violence':
-            is_immediate_harm = 'immediate' in classification.lower()
+            is_immediate_harm = result.is_immediate()
         else:
-            is_immediate_harm = 'immediate' in classification.lower() and perspective_score > 0.75
+            is_immediate_harm = (
+                result.is_immediate()
+                and perspective_score is not None
+                and perspective_score > 0.75
+            )
 
         mod_channel = self.mod_channels[self.guild_id]
         sysmsg = f'===== Immediate Harm Report =====\n'
@@ -285,74 +543,91 @@ class ModBot(discord.Client):
         if report.sub_sub_category is not None:
             sysmsg += f'- Clarifying category: `{report.sub_sub_category}`\n'
         sysmsg += f'- Content: "{report.message.content}"\n'
-        sysmsg += f'- Explanation: "{report.moderator_decision_explanation}"\n'
+        sysmsg += f'- Explanation: "{report.moderator_4o_decision_explanation}"\n'
         sysmsg += f'- Perspective Toxicity score: "{report.moderator_perspective_score}"\n'
-        await mod_channel.send(sysmsg)
+        self.outbound.send(mod_channel, sysmsg)
 
         return is_immediate_harm
             
 
-    async def handle_report(self):
+    async def handle_case(self, case):
         '''
-        A background task to handle report queue.
+        Classify and moderate one case taken from the report queue. Runs on
+        one of the report scheduler's workers.
         '''
-        await self.wait_until_ready()
-        while not self.is_closed():
-            # If the mod channel is set up and we have at least one report in the queue,
-            # start the review process
-            if self.mod_channels and self.report_queue:
-                # Retreive the report
-
-                sybilrank_score, _, report = heapq.heappop(self.report_queue)
-                
-                if report is not None:
-                    immediate_harm = await self.is_immediate_harm(report)
-
-                if report is None:
-                    # If it's a dummy report, do nothing
-                    await asyncio.sleep(20)
-                elif immediate_harm:
-                    # Handle immediate harm
-                    await self.handle_immediate_harm(report)
-                else:
-                    # Initiate appeal process
-                    # TODO: Move this into a new method and complete the process
-                    appeal_thread = await report.message.channel.create_thread(name="appeal process", invitable=False)
-                    await appeal_thread.add_user(report.message.author)
-                    message = report.message
-                    await appeal_thread.send(
-                        f'Your post on `{message.created_at:%m/%d/%Y}` has been reported for being `{report.category}`. ' +
-                        'This is a violation of Facebook\'s Community Guideline. Please take down or edit your post ' +
-                        'within the next 24 hours to avoid internal processing of the report.\n' +
-                        'If you belive this report is a mistake, please begin an appeal process.'
-                    )
-                    await appeal_thread.send("Submit your appeal here:")
-                    self.suggestive_harm_dict[appeal_thread.id] = (appeal_thread, report)
-            # Otherwise, sleep for 10 seconds
+        case.in_review = True
+        try:
+            if not await self.fetch_case_message(case):
+                await self.resolve_case(case, 'the reported message has been deleted.')
+                return
+            if await self.is_immediate_harm(case.report):
+                # Handle immediate harm
+                await self.handle_immediate_harm(case)
             else:
-                await asyncio.sleep(10)
+                # Initiate appeal process
+                await self.start_appeal(case)
+        except Exception:
+            # Close the case so it does not stay in review forever and swallow
+            # later reports of the same message; the scheduler logs the error
+            if self.open_cases.get(case.key) is case:
+                await self.resolve_case(case, 'we could not process it. Please report the message again if it is still up.')
+            raise
+
+
+    async def start_appeal(self, case):
+        report = case.report
+        appeal_thread = await report.message.channel.create_thread(name="appeal process", invitable=False)
+        await appeal_thread.add_user(report.message.author)
+        message = report.message
+        await appeal_thread.send(
+            f'Your post on `{message.created_at:%m/%d/%Y}` has been reported for being `{report.category}`. ' +
+            'This is a violation of Facebook\'s Community Guideline. Please take down or edit your post ' +
+            'within the next 24 hours to avoid internal processing of the report.\n' +
+            'If you belive this report is a mistake, please begin an appeal process.'
+        )
+        await appeal_thread.send("Submit your appeal here:")
+        self.suggestive_harm_dict[appeal_thread.id] = (appeal_thread, case)
+        self.report_store.set_appeal(case.store_id, appeal_thread.id)
 
 
-    async def handle_immediate_harm(self, report):
+    async def handle_immediate_harm(self, case):
         # Immediately remove content that are considered immediate harm.
+        report = case.report
         message = report.message
         violation_type = f'`{report.category}`'
         if report.category == 'Sexual':
             violation_type = 'being ' + violation_type
-        await report.message.author.send(
-            f'Your post on `{message.created_at:%m/%d/%Y}` has been reported for {violation_type}. ' +
-            'This is a violation of Facebook\'s Community Guideline.\n' +
-            'We have decided to take down the content. Thanks for your understanding.'
-        )
+        try:
+            await report.message.author.send(
+                f'Your post on `{message.created_at:%m/%d/%Y}` has been reported for {violation_type}. ' +
+                'This is a violation of Facebook\'s Community Guideline.\n' +
+                'We have decided to take down the content. Thanks for your understanding.'
+            )
+        except discord.HTTPException as e:
+            # The author may not accept DMs; the content is removed regardless
+            logger.warning(f'Could not warn author {message.author.id}: {e}')
         await report.message.delete()
-        sysmsg += 'Our system has decided that this content must be removed. '
+        mod_channel = self.mod_channels[self.guild_id]
+        sysmsg = 'Our system has decided that this content must be removed. '
         sysmsg += 'The post is deleted, and a warning is issued to the author.'
-        await mod_channel.send(sysmsg)
+        self.outbound.send(mod_channel, sysmsg)
+        await self.resolve_case(case, 'the content violated our guidelines and has been removed.')
 
 
     async def handle_appeal(self, message):
         # Retrieve the related report and appeal thread
-        thread, report = self.suggestive_harm_dict[message.channel.id]
+        thread, case = self.suggestive_harm_dict[message.channel.id]
+        if thread is None:
+            # Restored after a restart
+            self.suggestive_harm_dict[message.channel.id] = (message.channel, case)
+        if not await self.fetch_case_message(case):
+            # Deleted while the bot was down; there is nothing left to appeal
+            self.suggestive_harm_dict.pop(message.channel.id)
+            await message.channel.send('The reported message has been deleted, so there is nothing left to review. This thread will be closed soon.')
+            await self.resolve_case(case, 'the reported message has been deleted.')
+            self.timers.call_later(appeal_thread_close_delay, self.close_thread, message.channel)
+            return
+        report = case.report
         # Send everyting to the mod channel
         mod_channel = self.mod_channels[message.guild.id]
         sysmsg = f'===== Suggestive Harm Report =====\n'
@@ -362,26 +637,36 @@ class ModBot(discord.Client):
         if report.sub_sub_category is not None:
             sysmsg += f'- Clarifying category: `{report.sub_sub_category}`\n'
         sysmsg += f'- Content: "{report.message.content}"\n'
+        sysmsg += f'- Reports: `{case.num_reports}`\n'
         sysmsg += f'- Report description: "{report.report_description}"\n'
         sysmsg += f'- Appeal: "{message.content}"\n'
         sysmsg += '=============================\n'
         sysmsg += 'React to this message with:\n'
         sysmsg += '- 🟢 (keep the content)\n'
         sysmsg += '- 🔴 (remove the content)'
-        await mod_channel.send(sysmsg)
+        # Sent on its own: reactions to it are looked up by its id
+        review = await self.outbound.send(mod_channel, sysmsg, priority=outbound.HIGH, coalesce=False)
+        if self.open_cases.get(case.key) is not case:
+            # Decided on an earlier review message while this one was waiting
+            return
+        self.review_messages[review.id] = message.channel.id
+        case.review_message_ids += (review.id,)
+        # Reactions to it still count after a restart
+        self.report_store.add_review_message(review.id, case.store_id)
 
 
     async def on_reaction_add(self, reaction, user):
-        # Only handle reactions to manual review
-        if reaction.message.channel.name != f'group-{self.group_num}-mod':
+        # Only handle the two decisions on manual review messages
+        thread_id = self.review_messages.get(reaction.message.id)
+        if thread_id is None or str(reaction.emoji) not in ('🟢', '🔴'):
             return
-        if not re.search('Suggestive Harm Report', reaction.message.content):
-            return
-        
-        # Parse the appeal thread id and retrieve the report and thread
-        m = re.search('ID: `.*`', reaction.message.content)
-        thread_id = int(m.group(0)[5:-1])
-        thread, report = self.suggestive_harm_dict.pop(thread_id)
+
+        # Retrieve the report and thread; every review message of the case is done
+        thread, case = self.suggestive_harm_dict.pop(thread_id)
+        for message_id in case.review_message_ids:
+            self.review_messages.pop(message_id, None)
+        if thread is None:
+            thread = self.get_channel(thread_id) or await self.fetch_channel(thread_id)
 
         # Take actions based on the reaction
         if str(reaction.emoji) == '🟢':
@@ -389,45 +674,89 @@ class ModBot(discord.Client):
                 'We have reviewed your appeal and decided to keep your content.\n' +
                 'This thread will be closed soon. Thanks for your patience.'
             )
+            await self.resolve_case(case, 'after review, the content was found not to violate our guidelines and was kept.')
         elif str(reaction.emoji) == '🔴':
-            await report.message.delete()
+            if await self.fetch_case_message(case):
+                await case.message.delete()
             await thread.send(
                 'We have reviewed your appeal and decided to remove your content.\n' +
                 'This thread will be closed soon. Thanks for your understanding.'
             )
+            await self.resolve_case(case, 'after review, the content has been removed.')
         
-        # Sleep for 10 seconds and then close the appeal thread
-        await asyncio.sleep(10)
-        await thread.delete()
+        # Close the appeal thread after a while
+        self.timers.call_later(appeal_thread_close_delay, self.close_thread, thread)
+
+
+    async def close_thread(self, thread):
+        try:
+            await thread.delete()
+        except discord.NotFound:
+            # Already deleted by hand
+            pass
+
+
+    async def on_raw_message_delete(self, payload):
+        '''
+        Withdraw the case of a reported message that was deleted before a
+        moderator got to it.
+        '''
+        key = (payload.guild_id, payload.channel_id, payload.message_id)
+        case = self.open_cases.get(key)
+        if case is None or case.in_review:
+            return
+        if await self.report_scheduler.remove(key) is None:
+            return
+        await self.resolve_case(case, 'the reported message has been deleted.')
+
+
+    async def show_queue(self, channel):
+        # The highest-priority cases, best first, for the moderators
+        top = self.report_queue.top(queue_dashboard_size)
+        reply = f'{len(self.report_queue)} cases in the report queue'
+        if top:
+            reply += ', next up:'
+        for rank, (_, case, score) in enumerate(top, 1):
+            reply += f'\n{rank}. `{score:.2f}` `{case.category}`, {case.num_reports} report(s): {case.jump_url}'
+        reply += f'\n{self.outbound.depth(channel)} messages waiting to be sent to this channel'
+        self.outbound.send(channel, reply)
 
 
     async def handle_channel_message(self, message):
+        # Moderators can look at the report queue from the mod channel
+        if message.channel.name == f'group-{self.group_num}-mod':
+            if message.content == queue_keyword:
+                await self.show_queue(message.channel)
+            return
+
         # Only handle messages sent in the "group-#" channel
         if not message.channel.name == f'group-{self.group_num}':
             return
 
-        # Forward the message to the mod channel
-        mod_channel = self.mod_channels[message.guild.id]
-        await mod_channel.send(f'Forwarded message:\n{message.author.name}: "{message.content}"')
+        # Only forward the messages the pre-filter does not clear
         scores = self.eval_text(message.content)
-        await mod_channel.send(self.code_format(scores))
+        if not scores.escalate():
+            return
+        mod_channel = self.mod_channels[message.guild.id]
+        priority = outbound.HIGH if scores.decision == 'high_risk' else outbound.NORMAL
+        self.outbound.send(mod_channel, f'Forwarded message:\n{message.author.name}: "{message.content}"', priority=priority)
+        self.outbound.send(mod_channel, self.code_format(scores), priority=priority)
 
     
     def eval_text(self, message):
-        ''''
-        TODO: Once you know how you want to evaluate messages in your channel, 
-        insert your code here! This will primarily be used in Milestone 3. 
         '''
-        return message
+        Score a channel message with the local pre-filter.
+        '''
+        return self.prefilter.score(message)
 
     
-    def code_format(self, text):
-        ''''
-        TODO: Once you know how you want to show that a message has been 
-        evaluated, insert your code here for formatting the string to be 
-        shown in the mod channel. 
+    def code_format(self, scores):
+        '''
+        Describe the pre-filter verdict for the mod channel.
         '''
-        return "Evaluated: '" + text+ "'"
+        category = f'`{scores.category}`' if scores.category is not None else 'no category'
+        tier = f'decided by the {scores.tier} tier' if scores.tier != 'none' else 'no local match'
+        return f"Evaluated: {scores.decision.replace('_', ' ')} ({category}, risk {scores.risk:.2f}, {tier})"
 
 
 client = ModBot()
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import re
+import sys
+import time
+
+
+from check_classifiers import Checks, StandInServer
+from classifiers import BATCH_ANSWER_FORMAT, LLMBatcher, parse_batch_answer
+
+
+def batch_prompt(posts):
+    # Shaped like ModBot.generate_batch_prompt, without the few-shot guide
+    prompt = 'Posts:\n'
+    for i, post in enumerate(posts, 1):
+        prompt += f'Post {i}: {json.dumps(post)}\n'
+    return prompt + BATCH_ANSWER_FORMAT
+
+
+class Replies:
+    '''
+    Answers batch prompts with one JSON answer per post, in reverse order so
+    the answers have to be matched by number, or with a malformed array
+    while `malformed` is set. Single-post prompts get the usual two lines.
+    '''
+    def __init__(self):
+        self.malformed = False
+
+    def __call__(self, prompt: str) -> str:
+        posts = re.findall(r'^Post (\d+): (".*")$', prompt, re.MULTILINE)
+        if not posts:
+            return 'Classification: THIS POST IS A SUGGESTIVE HARM\nExplanation: classified alone'
+        if self.malformed:
+            return 'Here you go: [{"post": 1}]'
+        answers = [
+            {
+                'post': int(number),
+                'classification': 'Immediate Harm' if 'kill' in json.loads(post) else 'Suggestive Harm',
+                'explanation': f'about {json.loads(post)}',
+            }
+            for number, post in posts
+        ]
+        return '```json\n' + json.dumps(answers[::-1]) + '\n```'
+
+
+async def main():
+    '''
+    Check LLMBatcher against a stand-in completion endpoint that takes 0.2s
+    per request: concurrent posts share requests and get their own answers
+    back, a malformed batch answer falls back to single-post prompts,
+    request errors reach every waiting post, and parse_batch_answer rejects
+    answers that do not cover each post once. Returns the number of failed
+    checks.
+    '''
+    check = Checks()
+    replies = Replies()
+    server = StandInServer(replies, llm_delay=0.2, perspective_delay=0)
+    await server.start()
+    classifier = server.classifier(timeout=2.0)
+    batcher = LLMBatcher(classifier.complete, batch_prompt, window=0.05, max_size=8)
+    try:
+        posts = [f'post {i}' + (' kill' if i % 3 == 0 else '') for i in range(20)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            classifier.classify(f'single {post}', post, batcher=batcher) for post in posts
+        ])
+        seconds = time.perf_counter() - start
+        check('20 concurrent posts in 3 requests', len(server.prompts) == 3, f'{len(server.prompts)} requests, {seconds:.2f}s')
+        check('answers matched to their posts', all(
+            result.explanation == f'about {post}' and result.is_immediate() == ('kill' in post)
+            for post, result in zip(posts, results)
+        ))
+
+        server.prompts.clear()
+        replies.malformed = True
+        results = await asyncio.gather(*[classifier.classify(f'single {i}', f'p{i}', batcher=batcher) for i in range(3)])
+        replies.malformed = False
+        check(
+            'malformed batch answer falls back to single prompts',
+            len(server.prompts) == 4 and all(result.explanation == 'classified alone' for result in results),
+            f'{len(server.prompts)} requests',
+        )
+
+        server.llm_status = 500
+        results = await asyncio.gather(
+            *[classifier.classify('single', f'q{i}', batcher=batcher) for i in range(3)],
+            return_exceptions=True,
+        )
+        server.llm_status = 200
+        check('request error reaches every post', all(isinstance(result, Exception) for result in results))
+
+        server.prompts.clear()
+        await classifier.classify('single alone', 'alone', batcher=batcher)
+        check('a batch of one uses the single-post prompt', server.prompts == ['single alone'])
+
+        for answer in [
+            'no json here',
+            '[{"post": 1, "classification": "x"}, {"post": 1, "classification": "y"}]',
+            '[{"post": 3, "classification": "x"}, {"post": 1, "classification": "y"}]',
+        ]:
+            try:
+                parse_batch_answer(answer, 2)
+                check(f'parse_batch_answer rejects {answer[:30]!r}', False)
+            except ValueError:
+                check(f'parse_batch_answer rejects {answer[:30]!r}', True)
+    finally:
+        await classifier.close()
+        await server.stop()
+    return check.failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,141 @@
+import asyncio
+import sys
+import time
+
+
+from aiohttp import web
+
+from classifiers import ClassifierError, ModerationClassifier
+
+
+class StandInServer:
+    '''
+    Local stand-ins for the OpenAI chat completion endpoint and the
+    Perspective endpoint, so the classifiers can be checked without API
+    keys. `reply` turns the user prompt of a completion into its answer.
+    The delays and status codes can be changed between checks.
+    '''
+    def __init__(self, reply, llm_delay: float = 0.5, perspective_delay: float = 0.5):
+        self.reply = reply
+        self.llm_delay = llm_delay
+        self.llm_status = 200
+        self.perspective_delay = perspective_delay
+        self.perspective_status = 200
+        # User prompts of the completions received, and texts Perspective scored
+        self.prompts = []
+        self.texts = []
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat)
+        app.router.add_post('/analyze', self.analyze)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', 0).start()
+        self.port = self.runner.addresses[0][1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def classifier(self, timeout: float = 1.0) -> ModerationClassifier:
+        return ModerationClassifier(
+            'openai-key',
+            'perspective-key',
+            openai_base_url=f'http://127.0.0.1:{self.port}/v1',
+            perspective_url=f'http://127.0.0.1:{self.port}/analyze',
+            timeout=timeout,
+        )
+
+    async def chat(self, request):
+        body = await request.json()
+        prompt = body['messages'][-1]['content']
+        self.prompts.append(prompt)
+        await asyncio.sleep(self.llm_delay)
+        if self.llm_status != 200:
+            return web.Response(status=self.llm_status)
+        return web.json_response({
+            'id': 'stand-in',
+            'object': 'chat.completion',
+            'created': 0,
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': self.reply(prompt)},
+            }],
+        })
+
+    async def analyze(self, request):
+        body = await request.json()
+        self.texts.append(body['comment']['text'])
+        await asyncio.sleep(self.perspective_delay)
+        if self.perspective_status != 200:
+            return web.Response(status=self.perspective_status)
+        return web.json_response({'attributeScores': {'TOXICITY': {'summaryScore': {'value': 0.9}}}})
+
+
+class Checks:
+    def __init__(self):
+        self.failed = 0
+
+    def __call__(self, name: str, ok: bool, detail: str = ''):
+        print(f"{'OK' if ok else 'FAIL':>4}  {name}" + (f' ({detail})' if detail else ''))
+        self.failed += not ok
+
+
+def immediate_harm(prompt: str) -> str:
+    return 'Classification: THIS POST IS AN IMMEDIATE HARM\nExplanation: a direct threat'
+
+
+async def main():
+    '''
+    Check ModerationClassifier against stand-in servers that take 0.5s per
+    request: the two requests of a report run concurrently, reports do not
+    wait for each other, and timeouts and HTTP errors are handled as
+    documented in classify(). Returns the number of failed checks.
+    '''
+    check = Checks()
+    server = StandInServer(immediate_harm)
+    await server.start()
+    classifier = server.classifier(timeout=1.0)
+    try:
+        start = time.perf_counter()
+        result = await classifier.classify('prompt', 'reported message')
+        seconds = time.perf_counter() - start
+        check('LLM and Perspective run concurrently', seconds < 0.9, f'{seconds:.2f}s')
+        check('answer parsed', result.is_immediate() and result.explanation == 'a direct threat' and result.toxicity == 0.9)
+        check('Perspective scores the reported message', server.texts[-1] == 'reported message')
+
+        start = time.perf_counter()
+        await asyncio.gather(*[classifier.classify('prompt', f'message {i}') for i in range(10)])
+        seconds = time.perf_counter() - start
+        check('10 concurrent reports', seconds < 0.9, f'{seconds:.2f}s')
+
+        server.perspective_delay = 2.0
+        start = time.perf_counter()
+        result = await classifier.classify('prompt', 'slow')
+        seconds = time.perf_counter() - start
+        check('Perspective timeout leaves toxicity unset', result.toxicity is None and seconds < 1.5, f'{seconds:.2f}s')
+
+        server.perspective_delay = 0
+        server.perspective_status = 500
+        result = await classifier.classify('prompt', 'error')
+        check('Perspective error leaves toxicity unset', result.toxicity is None and result.is_immediate())
+
+        for name, delay, status in [('LLM timeout', 2.0, 200), ('LLM error', 0, 500)]:
+            server.llm_delay, server.llm_status = delay, status
+            try:
+                await classifier.classify('prompt', name)
+                check(f'{name} raises ClassifierError', False)
+            except ClassifierError:
+                check(f'{name} raises ClassifierError', True)
+    finally:
+        await classifier.close()
+        await server.stop()
+    return check.failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
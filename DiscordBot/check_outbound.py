@@ -0,0 +1,78 @@
+import asyncio
+import sys
+import time
+import types
+
+
+import outbound
+from check_classifiers import Checks
+from outbound import OutboundScheduler
+
+
+class FakeChannel:
+    '''
+    Records what would have been sent to a Discord channel, or fails every
+    send while `error` is set.
+    '''
+    def __init__(self, id: int, error: Exception = None):
+        self.id = id
+        self.error = error
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        if self.error is not None:
+            raise self.error
+        self.sent.append((content, kwargs))
+        return types.SimpleNamespace(id=len(self.sent))
+
+
+async def main():
+    '''
+    Check OutboundScheduler with fake channels: queued plain messages are
+    joined up to the length limit, higher priorities and standalone messages
+    keep their place, the token bucket paces standalone sends, and send
+    failures reach the caller awaiting them. Returns the number of failed
+    checks.
+    '''
+    check = Checks()
+    scheduler = OutboundScheduler(rate=5.0, burst=2)
+
+    lines = FakeChannel(1)
+    for i in range(50):
+        scheduler.send(lines, f'line {i}')
+    await scheduler.stop(timeout=5)
+    check('50 queued lines go out as one message', len(lines.sent) == 1 and lines.sent[0][0].count('line') == 50)
+
+    mixed = FakeChannel(2)
+    low = [scheduler.send(mixed, f'low {i}', priority=outbound.LOW) for i in range(3)]
+    scheduler.send(mixed, 'x' * (outbound.MAX_MESSAGE_LENGTH - 10))
+    review = scheduler.send(mixed, 'review', priority=outbound.HIGH, coalesce=False)
+    scheduler.send(mixed, 'image', file='heap.png')
+    check('queue depth', scheduler.depth(mixed) == 6 and len(scheduler) == 6)
+    message = await review
+    await scheduler.stop(timeout=5)
+    contents = [content for content, _ in mixed.sent]
+    check('HIGH goes first and alone', contents[0] == 'review' and message.id == 1)
+    check('messages never exceed the length limit', all(len(content) <= outbound.MAX_MESSAGE_LENGTH for content in contents))
+    check('files are sent on their own', ('image', {'file': 'heap.png'}) in mixed.sent)
+    check('LOW goes last, joined', contents[-1] == 'low 0\nlow 1\nlow 2' and all(future.done() for future in low), repr(contents[-1]))
+
+    paced = FakeChannel(3)
+    start = time.perf_counter()
+    await asyncio.gather(*[scheduler.send(paced, f'standalone {i}', coalesce=False) for i in range(12)])
+    seconds = time.perf_counter() - start
+    # Two from the burst, then ten at 5 per second
+    check('12 standalone sends at 5/s with a burst of 2', 1.8 <= seconds <= 2.5, f'{seconds:.2f}s')
+
+    failing = FakeChannel(4, error=RuntimeError('429 Too Many Requests'))
+    try:
+        await scheduler.send(failing, 'lost')
+        check('send failure reaches its caller', False)
+    except RuntimeError:
+        check('send failure reaches its caller', True)
+    await scheduler.stop(timeout=5)
+    return check.failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from classifiers import Classification
+
+
+logger = logging.getLogger('discord')
+
+# Zero-width characters are a cheap way to make copies of a message look different
+ZERO_WIDTH = re.compile('[\u200b\u200c\u200d\u2060\ufeff]')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text)
+    text = ZERO_WIDTH.sub('', text)
+    return WHITESPACE.sub(' ', text).strip().casefold()
+
+
+def content_key(text: str, category: Optional[str]) -> str:
+    data = f'{category or ""}\0{normalize(text)}'.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class ClassificationCache:
+    '''
+    Remote classifier results keyed by the hash of the normalized message
+    content and the report category, so the same message reported many times
+    is only classified once. Entries expire `ttl` seconds after they were
+    stored, and the least recently used entry is evicted beyond `max_size`.
+
+    Expiry uses wall-clock time so entries saved to `path` stay valid across
+    restarts for the rest of their TTL.
+    '''
+    def __init__(self, max_size: int = 10000, ttl: float = 24 * 3600, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # Misses that waited for an identical classification already running
+        self.coalesced = 0
+        self._entries = OrderedDict()  # key -> (expires_at, Classification)
+        # Classifications in flight, so concurrent duplicates share one call
+        self._pending = {}
+        if path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text: str, category: Optional[str]) -> Optional[Classification]:
+        key = content_key(text, category)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, text: str, category: Optional[str], result: Classification):
+        self._store(content_key(text, category), time.time() + self.ttl, result)
+
+    def _store(self, key: str, expires_at: float, result: Classification):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_classify(
+            self,
+            text: str,
+            category: Optional[str],
+            classify: Callable[[], Awaitable[Classification]],
+        ) -> Classification:
+        '''
+        Return the cached result, or await `classify()` and cache what it
+        returns. Duplicates that arrive while the first call is still running
+        wait for that call instead of starting their own. Exceptions are
+        passed to every waiter and nothing is cached. Neither is a result
+        without a toxicity score (a failed Perspective call), so the next
+        duplicate tries again.
+        '''
+        result = self.get(text, category)
+        if result is not None:
+            return result
+        key = content_key(text, category)
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The first caller was cancelled, not us: classify ourselves
+                return await self.get_or_classify(text, category, classify)
+        pending = asyncio.get_running_loop().create_future()
+        self._pending[key] = pending
+        try:
+            result = await classify()
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Mark the exception as retrieved in case nobody else waited
+            pending.exception()
+            raise
+        else:
+            if result.toxicity is not None:
+                self._store(key, time.time() + self.ttl, result)
+            pending.set_result(result)
+            return result
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def save(self):
+        '''
+        Write the unexpired entries to `path`, least recently used first, and
+        replace the file atomically.
+        '''
+        if self.path is None:
+            return
+        now = time.time()
+        entries = [
+            [key, expires_at, result.category, result.explanation, result.toxicity]
+            for key, (expires_at, result) in self._entries.items()
+            if expires_at > now
+        ]
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f'Could not load the classification cache from {self.path}: {e}')
+            return
+        now = time.time()
+        for key, expires_at, category, explanation, toxicity in entries:
+            if expires_at > now:
+                self._store(key, expires_at, Classification(category, explanation, toxicity))
+        logger.info(f'Loaded {len(self._entries)} cached classifications from {self.path}')
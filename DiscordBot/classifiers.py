@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import aiohttp
+from openai import AsyncOpenAI
+
+
+logger = logging.getLogger('discord')
+
+PERSPECTIVE_URL = 'https://commentanalyzer.googleapis.com/v1alpha1/comments:analyze'
+SYSTEM_PROMPT = (
+    "Your job is to classify the following post based on its content. Determine whether it falls under "
+    "'immediate harm' or 'suggestive harm' according to the criteria outlined in the Reporting Guide. "
+    "Use the definitions below to make your classification:"
+)
+# Appended to a prompt listing several numbered posts
+BATCH_ANSWER_FORMAT = (
+    'Answer with only a JSON array holding one object per post, in the order of the posts, like this:\n'
+    '[{"post": 1, "classification": "Immediate Harm" or "Suggestive Harm", "explanation": "[Your explanation here]"}]'
+)
+
+
+class ClassifierError(Exception):
+    pass
+
+
+class Classification:
+    '''
+    The combined answer of both remote classifiers for one post. `toxicity`
+    is None if the Perspective call failed.
+    '''
+    def __init__(self, category: str, explanation: str, toxicity: Optional[float]):
+        self.category = category
+        self.explanation = explanation
+        self.toxicity = toxicity
+
+    def is_immediate(self):
+        return 'immediate' in self.category.lower()
+
+
+def parse_llm_answer(answer: str):
+    '''
+    Extract the "Classification: ..." and "Explanation: ..." lines the prompt
+    asks for. A reply that does not follow the format is kept whole as the
+    category so nothing is lost.
+    '''
+    classification = re.search(r'Classification: (.+)', answer)
+    explanation = re.search(r'Explanation: (.+)', answer)
+    if classification is None:
+        return answer.strip(), ''
+    return classification.group(1).strip(), explanation.group(1).strip() if explanation else ''
+
+
+def parse_batch_answer(answer: str, count: int) -> List[Tuple[str, str]]:
+    '''
+    Read the (classification, explanation) of each of `count` posts from a
+    reply in the BATCH_ANSWER_FORMAT. Raises ValueError unless every post
+    has exactly one answer.
+    '''
+    # Tolerate prose or a code fence around the array
+    start, end = answer.find('['), answer.rfind(']')
+    if start < 0 or end < start:
+        raise ValueError('No JSON array in the batch answer')
+    items = json.loads(answer[start:end + 1])
+    if not isinstance(items, list) or len(items) != count:
+        raise ValueError(f'Expected {count} answers, got {len(items) if isinstance(items, list) else items!r}')
+    results = [None] * count
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('classification'), str):
+            raise ValueError(f'Malformed answer {item!r}')
+        post = item.get('post')
+        if not isinstance(post, int) or not 1 <= post <= count or results[post - 1] is not None:
+            raise ValueError(f'Answer for unknown or repeated post {post!r}')
+        results[post - 1] = (item['classification'].strip(), str(item.get('explanation', '')).strip())
+    return results
+
+
+class LLMBatcher:
+    '''
+    Groups LLM classifications into one request per batch. A request waits
+    at most `window` seconds for others, and a batch is sent as soon as it
+    holds `max_size` posts, so the few-shot instructions are sent once per
+    batch instead of once per post.
+
+    `build_prompt` turns the posts of a batch into a prompt asking for the
+    BATCH_ANSWER_FORMAT. If a batch answer cannot be parsed, every post in
+    it is classified on its own with its single-post prompt instead.
+    '''
+    def __init__(
+            self,
+            complete: Callable[[str], Awaitable[str]],
+            build_prompt: Callable[[List[str]], str],
+            window: float = 0.05,
+            max_size: int = 8,
+        ):
+        self.complete = complete
+        self.build_prompt = build_prompt
+        self.window = window
+        self.max_size = max_size
+        self.requests = 0
+        self.posts = 0
+        self.fallbacks = 0
+        self._pending = []  # (post, single-post prompt, future)
+        self._timer = None
+        self._flushes = set()
+
+    async def answer(self, prompt: str, post: str) -> Tuple[str, str]:
+        '''
+        The (classification, explanation) for `post`; `prompt` is its
+        single-post prompt, used if it has to be classified alone.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((post, prompt, future))
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers that gave up (timed out) are left out of the batch
+        batch = [item for item in self._pending if not item[2].done()]
+        self._pending = []
+        if batch:
+            task = asyncio.create_task(self.send(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def send(self, batch):
+        self.posts += len(batch)
+        if len(batch) == 1:
+            post, prompt, future = batch[0]
+            await self.send_single(prompt, future)
+            return
+        self.requests += 1
+        try:
+            answer = await self.complete(self.build_prompt([post for post, _, _ in batch]))
+            results = parse_batch_answer(answer, len(batch))
+        except ValueError as e:
+            logger.warning(f'Could not parse a batch of {len(batch)} classifications, classifying them one by one: {e}')
+            self.fallbacks += 1
+            await asyncio.gather(*[self.send_single(prompt, future) for _, prompt, future in batch])
+            return
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def send_single(self, prompt, future):
+        self.requests += 1
+        try:
+            result = parse_llm_answer(await self.complete(prompt))
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'posts': self.posts,
+            'posts_per_request': self.posts / self.requests if self.requests else 0.0,
+            'fallbacks': self.fallbacks,
+        }
+
+
+class ModerationClassifier:
+    '''
+    Long-lived, non-blocking clients for the LLM and Perspective classifiers.
+    Both clients keep their HTTP connections pooled between reports, and the
+    two requests of a report run concurrently, each with its own timeout.
+
+    `openai_base_url` and `perspective_url` point the classifier at any
+    compatible endpoint, e.g. local stand-in servers when testing.
+    '''
+    def __init__(
+            self,
+            openai_api_key: str,
+            perspective_api_key: str,
+            openai_base_url: Optional[str] = None,
+            perspective_url: str = PERSPECTIVE_URL,
+            model: str = 'gpt-4o',
+            timeout: float = 30.0,
+            max_connections: int = 16,
+        ):
+        self.openai_api_key = openai_api_key
+        self.perspective_api_key = perspective_api_key
+        self.openai_base_url = openai_base_url
+        self.perspective_url = perspective_url
+        self.model = model
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.llm = None
+        self.session = None
+
+    async def start(self):
+        '''
+        Create the clients. Must run inside the event loop that uses them.
+        '''
+        if self.session is not None:
+            return
+        # Timeouts are enforced per call by asyncio.wait_for; retries would
+        # only stretch a report past its deadline
+        self.llm = AsyncOpenAI(api_key=self.openai_api_key, base_url=self.openai_base_url, max_retries=0)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            raise_for_status=True,
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            await self.llm.close()
+            self.session = None
+            self.llm = None
+
+    async def complete(self, prompt: str, system_prompt: str = SYSTEM_PROMPT) -> str:
+        response = await self.llm.chat.completions.create(
+            # temperature
+            # The temperature of the sampling distribution. Must be strictly positive.
+            temperature=0.0,
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ],
+        )
+        return response.choices[0].message.content
+
+    async def toxicity(self, text: str) -> float:
+        analyze_request = {
+            'comment': {'text': text},
+            'requestedAttributes': {'TOXICITY': {}},
+        }
+        async with self.session.post(
+            self.perspective_url,
+            params={'key': self.perspective_api_key},
+            json=analyze_request,
+        ) as response:
+            response_pers = await response.json()
+        return response_pers["attributeScores"]["TOXICITY"]["summaryScore"]["value"]
+
+    async def answer(self, prompt: str) -> Tuple[str, str]:
+        return parse_llm_answer(await self.complete(prompt))
+
+    async def classify(self, prompt: str, text: str, batcher: Optional[LLMBatcher] = None) -> Classification:
+        '''
+        Ask the LLM about `prompt` and Perspective about `text` at the same
+        time. Raises ClassifierError if the LLM call fails or times out; a
+        failed Perspective call only leaves the toxicity unset.
+
+        With a `batcher`, the LLM sees `text` batched with other posts, and
+        `prompt` is only used if it has to be classified on its own.
+        '''
+        await self.start()
+        llm = batcher.answer(prompt, text) if batcher is not None else self.answer(prompt)
+        answer, toxicity = await asyncio.gather(
+            asyncio.wait_for(llm, self.timeout),
+            asyncio.wait_for(self.toxicity(text), self.timeout),
+            return_exceptions=True,
+        )
+        if isinstance(answer, BaseException):
+            raise ClassifierError(f'LLM classification failed: {answer!r}') from answer
+        if isinstance(toxicity, BaseException):
+            # The request URL carries the API key, so only log the error type
+            status = getattr(toxicity, 'status', None)
+            logger.warning(f'Perspective request failed: {type(toxicity).__name__}' + (f' (HTTP {status})' if status else ''))
+            toxicity = None
+        category, explanation = answer
+        return Classification(category, explanation, toxicity)
@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+
+logger = logging.getLogger('discord')
+
+# Message priorities, most important first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+# Discord's limit on the length of one message
+MAX_MESSAGE_LENGTH = 2000
+
+
+class TokenBucket:
+    '''
+    Allows `rate` sends per second on average and bursts of up to
+    `capacity` sends.
+    '''
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        # Seconds until a token is available; 0 if one is available now
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    def __init__(self, content, kwargs, coalesce, future):
+        self.content = content
+        self.kwargs = kwargs
+        # Only plain text can be merged with its neighbours
+        self.coalesce = coalesce and content is not None and not kwargs
+        self.future = future
+
+
+class ChannelQueue:
+    def __init__(self, channel, bucket: TokenBucket):
+        self.channel = channel
+        self.bucket = bucket
+        self.messages = []  # heap of (priority, seq, OutboundMessage)
+        self.task = None
+
+
+class OutboundScheduler:
+    '''
+    Sends messages to Discord channels without running into rate limits.
+    Every channel has its own queue, token bucket and sender task, which
+    exists only while the queue has messages. Messages are sent most
+    important first, first come first served within a priority.
+
+    When a token frees up, the next message is merged with the plain text
+    messages queued right behind it, up to MAX_MESSAGE_LENGTH characters,
+    so a burst goes out as a few long messages instead of many short ones.
+    Pass `coalesce=False` for messages that must stay on their own, e.g.
+    when their id is used later.
+    '''
+    def __init__(self, rate: float = 1.0, burst: int = 5, max_length: int = MAX_MESSAGE_LENGTH):
+        self.rate = rate
+        self.burst = burst
+        self.max_length = max_length
+        self.sent = 0
+        self.coalesced = 0
+        self._channels = {}
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return sum(len(queue.messages) for queue in self._channels.values())
+
+    def depth(self, channel) -> int:
+        queue = self._channels.get(channel.id)
+        return len(queue.messages) if queue is not None else 0
+
+    def send(self, channel, content=None, priority: int = NORMAL, coalesce: bool = True, **kwargs) -> asyncio.Future:
+        '''
+        Queue a message; `kwargs` are passed on to channel.send. Returns a
+        future for the sent discord.Message, which callers may ignore: send
+        failures are logged either way.
+        '''
+        future = asyncio.get_running_loop().create_future()
+        queue = self._channels.get(channel.id)
+        if queue is None:
+            queue = self._channels[channel.id] = ChannelQueue(channel, TokenBucket(self.rate, self.burst))
+        heapq.heappush(queue.messages, (priority, next(self._seq), OutboundMessage(content, kwargs, coalesce, future)))
+        if queue.task is None:
+            queue.task = asyncio.create_task(self.drain(queue), name=f'outbound-{channel.id}')
+        return future
+
+    def next_batch(self, queue: ChannelQueue):
+        _, _, first = heapq.heappop(queue.messages)
+        batch = [first]
+        if not first.coalesce:
+            return batch
+        length = len(first.content)
+        while queue.messages:
+            following = queue.messages[0][2]
+            if not following.coalesce or length + 1 + len(following.content) > self.max_length:
+                break
+            heapq.heappop(queue.messages)
+            batch.append(following)
+            length += 1 + len(following.content)
+        return batch
+
+    async def drain(self, queue: ChannelQueue):
+        try:
+            while queue.messages:
+                delay = queue.bucket.wait_time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                queue.bucket.take()
+                batch = self.next_batch(queue)
+                content = '\n'.join(message.content for message in batch) if len(batch) > 1 else batch[0].content
+                try:
+                    sent = await queue.channel.send(content, **batch[0].kwargs)
+                except Exception as e:
+                    logger.warning(f'Could not send a message to channel {queue.channel.id}: {e!r}')
+                    for message in batch:
+                        if not message.future.done():
+                            message.future.set_exception(e)
+                            # Mark the exception as retrieved in case nobody awaits it
+                            message.future.exception()
+                    continue
+                self.sent += 1
+                self.coalesced += len(batch) - 1
+                for message in batch:
+                    if not message.future.done():
+                        message.future.set_result(sent)
+        finally:
+            queue.task = None
+            if queue.messages:
+                # Cancelled with messages left; fail them rather than leave callers waiting
+                for _, _, message in queue.messages:
+                    message.future.cancel()
+                queue.messages.clear()
+
+    async def stop(self, timeout: float = None):
+        '''
+        Wait for the queued messages to be sent, for at most `timeout`
+        seconds; whatever is left is dropped.
+        '''
+        tasks = [queue.task for queue in self._channels.values() if queue.task is not None]
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.warning(f'Dropped the outbound messages of {len(pending)} channels at shutdown')
+
+    def stats(self) -> dict:
+        return {
+            'queued': len(self),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+        }
@@ -0,0 +1,333 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import zlib
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from classification_cache import normalize
+from report import Report
+
+
+logger = logging.getLogger('discord')
+
+CATEGORIES = Report.CATEGORIES
+
+# Seed lexicon of phrase -> (category, risk). Matched on whole words of the
+# normalized text, so "kill" does not fire on "skill".
+KEYWORDS = {
+    'kill you': ('Violence', 0.9),
+    'i will kill': ('Violence', 0.95),
+    'shoot up': ('Violence', 0.9),
+    'bomb the': ('Violence', 0.9),
+    'behead': ('Violence', 0.85),
+    'kill yourself': ('Violence', 0.95),
+    'kys': ('Violence', 0.9),
+    'end it all': ('Violence', 0.7),
+    'suicide': ('Violence', 0.6),
+    'nudes': ('Sexual', 0.8),
+    'send nudes': ('Sexual', 0.9),
+    'onlyfans': ('Sexual', 0.5),
+    'porn': ('Sexual', 0.7),
+    'pirated': ('Copyright', 0.6),
+    'free download': ('Copyright', 0.4),
+    'cracked version': ('Copyright', 0.6),
+    'doxx': ('Harassment', 0.8),
+    'home address': ('Harassment', 0.6),
+    'no one likes you': ('Harassment', 0.8),
+    'nobody likes you': ('Harassment', 0.8),
+    'loser': ('Harassment', 0.4),
+    'just disappear': ('Harassment', 0.6),
+    'click here': ('Misleading', 0.4),
+    'limited time': ('Misleading', 0.3),
+    'free money': ('Misleading', 0.7),
+    'guaranteed returns': ('Misleading', 0.8),
+    'send crypto': ('Misleading', 0.8),
+    'wake up sheeple': ('Misleading', 0.6),
+    'get rid of them': ('Inflammatory', 0.8),
+    'ruining our country': ('Inflammatory', 0.7),
+    'go back to your country': ('Inflammatory', 0.85),
+    'subhuman': ('Inflammatory', 0.9),
+}
+
+# How a message left the cascade: 'clear' (benign, stays local), 'uncertain'
+# and 'high_risk' (both sent on to the remote classifiers)
+DECISIONS = ('clear', 'uncertain', 'high_risk')
+# The stage that made the decision; 'none' when no local stage could
+TIERS = ('keyword', 'model', 'none')
+
+TOKEN = re.compile(r'\w+')
+
+
+class KeywordMatcher:
+    '''
+    Aho-Corasick automaton over a phrase lexicon: one pass over the text
+    finds every phrase, however many there are.
+    '''
+    def __init__(self, keywords: Dict[str, Tuple[str, float]]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for phrase, value in keywords.items():
+            phrase = normalize(phrase)
+            node = 0
+            for ch in phrase:
+                child = self._goto[node].get(ch)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][ch] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = child
+            self._out[node].append((len(phrase), value))
+        # Breadth-first, so the failure target of a node is always done first
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str):
+        '''
+        The (category, risk) of every whole-word phrase match in `text`,
+        which must already be normalized.
+        '''
+        goto, fail, out = self._goto, self._fail, self._out
+        matches = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            after = i + 1
+            if after < len(text) and text[after].isalnum():
+                continue
+            for length, value in out[node]:
+                start = i - length + 1
+                if start == 0 or not text[start - 1].isalnum():
+                    matches.append(value)
+        return matches
+
+
+def features(text: str, buckets: int):
+    # Hashed word unigrams and bigrams; crc32 so buckets are stable across runs
+    tokens = TOKEN.findall(text)
+    grams = tokens + [a + ' ' + b for a, b in zip(tokens, tokens[1:])]
+    return {zlib.crc32(gram.encode('utf-8')) % buckets for gram in grams}
+
+
+class NgramModel:
+    '''
+    One-vs-rest logistic regression over hashed word n-grams, one output per
+    category. Weights are stored sparsely: only buckets seen in training.
+    '''
+    def __init__(self, categories=CATEGORIES, buckets: int = 1 << 18):
+        self.categories = list(categories)
+        self.buckets = buckets
+        self.bias = [0.0] * len(self.categories)
+        self.weights = {}  # bucket -> [weight per category]
+
+    def predict(self, text: str):
+        '''
+        The probability of each category for normalized `text`.
+        '''
+        logits = list(self.bias)
+        for bucket in features(text, self.buckets):
+            row = self.weights.get(bucket)
+            if row is not None:
+                logits = [logit + w for logit, w in zip(logits, row)]
+        return [1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, logit)))) for logit in logits]
+
+    def train(self, examples, epochs: int = 10, lr: float = 0.5, l2: float = 1e-6, seed: int = 0):
+        '''
+        Plain SGD on (text, category) pairs, category None for benign text.
+        '''
+        n = len(self.categories)
+        data = [(features(normalize(text), self.buckets), category) for text, category in examples]
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for buckets, category in data:
+                logits = self.bias[:]
+                rows = [self.weights.setdefault(bucket, [0.0] * n) for bucket in buckets]
+                for row in rows:
+                    logits = [logit + w for logit, w in zip(logits, row)]
+                grads = [
+                    1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, logit)))) - (self.categories[k] == category)
+                    for k, logit in enumerate(logits)
+                ]
+                for row in rows:
+                    for k in range(n):
+                        row[k] -= lr * (grads[k] + l2 * row[k])
+                for k in range(n):
+                    self.bias[k] -= lr * grads[k]
+
+    def save(self, path: str):
+        model = {
+            'categories': self.categories,
+            'buckets': self.buckets,
+            'bias': self.bias,
+            'weights': {str(bucket): row for bucket, row in self.weights.items()},
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(model, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str):
+        with open(path) as f:
+            data = json.load(f)
+        model = NgramModel(data['categories'], data['buckets'])
+        model.bias = data['bias']
+        model.weights = {int(bucket): row for bucket, row in data['weights'].items()}
+        return model
+
+
+class PrefilterResult:
+    '''
+    The local verdict on one message: the likeliest category (None if
+    nothing stood out), its risk in [0, 1], the decision and the tier that
+    made it.
+    '''
+    def __init__(self, category: Optional[str], risk: float, decision: str, tier: str):
+        self.category = category
+        self.risk = risk
+        self.decision = decision
+        self.tier = tier
+
+    def escalate(self):
+        return self.decision != 'clear'
+
+
+class Prefilter:
+    '''
+    A cascade of cheap local checks in front of the remote classifiers:
+
+    1. The keyword automaton. A phrase with risk at or above
+       `flag_threshold` decides on the spot.
+    2. The n-gram model, if one is loaded from `model_path`. The message
+       risk is the highest of the keyword and model scores.
+
+    A risk of at most `clear_threshold` is cleared locally, anything at or
+    above `flag_threshold` is high risk, and the rest is uncertain. Without
+    a model, a message no keyword matched is uncertain, never cleared.
+    '''
+    def __init__(
+            self,
+            model_path: Optional[str] = None,
+            keywords: Dict[str, Tuple[str, float]] = KEYWORDS,
+            clear_threshold: float = 0.2,
+            flag_threshold: float = 0.8,
+        ):
+        self.clear_threshold = clear_threshold
+        self.flag_threshold = flag_threshold
+        self.keywords = KeywordMatcher(keywords)
+        self.model = None
+        if model_path is not None:
+            try:
+                self.model = NgramModel.load(model_path)
+            except FileNotFoundError:
+                logger.info(f'No prefilter model at {model_path}; using keywords only')
+        self.counts = {tier: dict.fromkeys(DECISIONS, 0) for tier in TIERS}
+
+    def decide(self, risk: float):
+        if risk >= self.flag_threshold:
+            return 'high_risk'
+        if risk <= self.clear_threshold:
+            return 'clear'
+        return 'uncertain'
+
+    def score(self, text: str) -> PrefilterResult:
+        text = normalize(text)
+        category, risk = None, 0.0
+        for match_category, match_risk in self.keywords.find(text):
+            if match_risk > risk:
+                category, risk = match_category, match_risk
+        if risk >= self.flag_threshold:
+            result = PrefilterResult(category, risk, 'high_risk', 'keyword')
+        elif self.model is not None:
+            probs = self.model.predict(text)
+            best = max(range(len(probs)), key=probs.__getitem__)
+            if probs[best] > risk:
+                category, risk = self.model.categories[best], probs[best]
+            decision = self.decide(risk)
+            result = PrefilterResult(category if decision != 'clear' else None, risk, decision, 'model')
+        elif category is not None:
+            # A weak keyword match alone is not enough to clear or flag
+            result = PrefilterResult(category, risk, 'uncertain', 'keyword')
+        else:
+            result = PrefilterResult(None, 0.0, 'uncertain', 'none')
+        self.counts[result.tier][result.decision] += 1
+        return result
+
+    def stats(self) -> dict:
+        '''
+        For each tier, how many messages it decided and what share of all
+        messages that is, and the share escalated to the remote classifiers.
+        '''
+        total = sum(sum(decisions.values()) for decisions in self.counts.values())
+        stats = {}
+        for tier, decisions in self.counts.items():
+            decided = sum(decisions.values())
+            stats[tier] = dict(decisions, decided=decided, hit_rate=decided / total if total else 0.0)
+        cleared = sum(decisions['clear'] for decisions in self.counts.values())
+        stats['escalation_rate'] = (total - cleared) / total if total else 0.0
+        return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Train the n-gram model of the report prefilter.')
+    parser.add_argument('--data', type=str, required=True,
+                        help='Training data, one "category<TAB>text" per line; category "none" for benign text')
+    parser.add_argument('--out', type=str, default='prefilter_model.json', help='Where to save the model')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.5)
+    parser.add_argument('--buckets', type=int, default=1 << 18, help='Number of hashed n-gram buckets')
+    parser.add_argument('--holdout', type=float, default=0.1, help='Share of the data held out for evaluation')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    examples = []
+    with open(args.data, encoding='utf-8') as f:
+        for line in f:
+            category, _, text = line.rstrip('\n').partition('\t')
+            if category not in CATEGORIES and category != 'none':
+                raise ValueError(f'Unknown category {category!r}')
+            examples.append((text, None if category == 'none' else category))
+    random.Random(0).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout))
+    train, test = examples[:split], examples[split:]
+
+    model = NgramModel(buckets=args.buckets)
+    model.train(train, epochs=args.epochs, lr=args.lr)
+    model.save(args.out)
+    print(f'Trained on {len(train)} examples, saved to {args.out}')
+
+    if test:
+        prefilter = Prefilter()
+        prefilter.model = model
+        correct = 0
+        for text, category in test:
+            result = prefilter.score(text)
+            correct += result.category == category if category else not result.escalate()
+        print(f'Held-out accuracy: {correct / len(test):.3f} on {len(test)} examples')
+        print(json.dumps(prefilter.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -256,3 +256,124 @@ class Report:
 
     
 
+
+
+class ReportCase:
+    '''
+    All reports of the same message, queued and handled as one case. The
+    first report decides the category shown to moderators; every reporter is
+    told the outcome.
+    '''
+    def __init__(self, report, score):
+        self.key = ReportCase.key_of(report.message)
+        self.message = report.message
+        self.reports = []
+        # Sybil score of every distinct reporter, taken when they first reported
+        self.scores = {}
+        # Number of reports of a restored case still only in the report store;
+        # they are read back by load_stored when the case is handled or
+        # another report joins it. Until then the case keeps the combined
+        # score and first category stored with it.
+        self.stored = 0
+        self.stored_score = None
+        self.stored_category = None
+        # Whether moderation has started; later reports then only join the case
+        self.in_review = False
+        # Id of the case in the report store
+        self.store_id = None
+        # Ids of the mod channel messages asking moderators to review the appeal
+        self.review_message_ids = ()
+        self.add(report, score)
+
+    @classmethod
+    def restore(cls, row):
+        '''
+        A case loaded from the report store, given its row (see
+        ReportStore.load). Restoring a large queue builds one of these per
+        case, so its reports stay in the store for now.
+        '''
+        case_id, guild_id, channel_id, message_id, _, _, score, num_reports, category = row
+        case = cls.__new__(cls)
+        case.key = (guild_id, channel_id, message_id)
+        # No message until it is fetched again, and no reports until
+        # load_stored; an empty tuple is one object less for the collector
+        case.message = None
+        case.reports = ()
+        case.scores = {}
+        case.stored = num_reports
+        case.stored_score = score
+        case.stored_category = category
+        case.in_review = False
+        case.store_id = case_id
+        case.review_message_ids = ()
+        return case
+
+    def load_stored(self, rows, client):
+        '''
+        Turn the report rows read back for a restored case (see
+        ReportStore.load_reports) into Report objects, ahead of any report
+        that joined it since.
+        '''
+        reports = []
+        scores = {}
+        for reporter_id, score, category, sub_category, sub_sub_category, description in rows:
+            report = Report(client)
+            report.message = self.message
+            report.reporter_id = reporter_id
+            report.category = category
+            report.sub_category = sub_category
+            report.sub_sub_category = sub_sub_category
+            report.report_description = description
+            reports.append(report)
+            scores.setdefault(reporter_id, score)
+        for reporter_id, score in self.scores.items():
+            scores.setdefault(reporter_id, score)
+        self.reports = reports + list(self.reports)
+        self.scores = scores
+        self.stored = 0
+
+    @staticmethod
+    def key_of(message):
+        guild_id = message.guild.id if message.guild is not None else None
+        return (guild_id, message.channel.id, message.id)
+
+    @property
+    def report(self):
+        # Restored cases need their stored reports loaded first
+        return self.reports[0]
+
+    @property
+    def category(self):
+        return self.stored_category if self.stored else self.reports[0].category
+
+    @property
+    def num_reports(self):
+        return self.stored + len(self.reports)
+
+    @property
+    def jump_url(self):
+        guild_id, channel_id, message_id = self.key
+        return f'https://discord.com/channels/{guild_id or "@me"}/{channel_id}/{message_id}'
+
+    @property
+    def reporter_ids(self):
+        return list(self.scores)
+
+    def add(self, report, score):
+        self.reports.append(report)
+        self.scores.setdefault(report.reporter_id, score)
+
+    def combined_score(self):
+        '''
+        Combine the Sybil scores of all reporters (lower is more trustworthy).
+        Each score is clamped to [0, 1] and read as the chance that reporter
+        is not trustworthy, so the case score is the chance that none of them
+        is. Every additional reporter can only lower it, and trusted
+        reporters lower it the most. Repeat reports by the same user count once.
+        '''
+        if self.stored:
+            return self.stored_score
+        combined = 1.0
+        for score in self.scores.values():
+            combined *= min(1.0, max(0.0, score))
+        return combined
@@ -0,0 +1,168 @@
+import heapq
+import itertools
+from collections.abc import Sequence
+
+
+class HeapView(Sequence):
+    '''
+    A read-only view of a ReportQueue as (priority, seq, item) tuples in heap
+    array order, the layout utils.visualize_heap draws. Nothing is copied.
+    '''
+    def __init__(self, heap):
+        self._heap = heap
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __getitem__(self, i):
+        priority, seq, _, item = self._heap[i]
+        return priority, seq, item
+
+
+class ReportQueue:
+    '''
+    A binary min-heap of items keyed by a hashable id, with the heap position
+    of every key tracked so priorities can be changed and items removed in
+    O(log n). Lower priority values come out first; equal priorities come out
+    in insertion order thanks to a monotonic sequence number, so items are
+    never compared with each other.
+    '''
+    def __init__(self):
+        self._heap = []  # [priority, seq, key, item]
+        self._index = {}  # key -> position in _heap
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __bool__(self):
+        return bool(self._heap)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def push(self, key, item, priority):
+        if key in self._index:
+            raise KeyError(f'{key!r} is already queued')
+        self._heap.append([priority, next(self._seq), key, item])
+        self._index[key] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def load(self, entries):
+        '''
+        Fill an empty queue with (key, item, priority) entries given in
+        first-come order. Builds the heap in one O(n) pass instead of n pushes.
+        '''
+        if self._heap:
+            raise ValueError('Can only load into an empty report queue')
+        self._heap.extend([priority, next(self._seq), key, item] for key, item, priority in entries)
+        heapq.heapify(self._heap)
+        self._index.update((entry[2], i) for i, entry in enumerate(self._heap))
+        if len(self._index) != len(self._heap):
+            self._heap.clear()
+            self._index.clear()
+            raise KeyError('Duplicate keys in the loaded entries')
+
+    def pop(self):
+        '''
+        Remove and return the (key, item, priority) with the lowest priority.
+        '''
+        if not self._heap:
+            raise IndexError('pop from an empty report queue')
+        priority, _, key, item = self._heap[0]
+        self._remove_at(0)
+        return key, item, priority
+
+    def peek(self):
+        priority, _, key, item = self._heap[0]
+        return key, item, priority
+
+    def get(self, key):
+        return self._heap[self._index[key]][3]
+
+    def priority(self, key):
+        return self._heap[self._index[key]][0]
+
+    def position(self, key):
+        # Index of the key in the heap array, as drawn by heap_view()
+        return self._index[key]
+
+    def update(self, key, priority):
+        '''
+        Change the priority of a queued key. The key keeps its sequence
+        number, so among equal priorities it keeps its place in line.
+        '''
+        i = self._index[key]
+        old = self._heap[i][0]
+        self._heap[i][0] = priority
+        if priority < old:
+            self._sift_up(i)
+        elif priority > old:
+            self._sift_down(i)
+
+    def remove(self, key):
+        i = self._index[key]
+        item = self._heap[i][3]
+        self._remove_at(i)
+        return item
+
+    def top(self, k: int):
+        '''
+        The k highest-priority (key, item, priority) in order, without
+        changing the queue. Walks the heap best-first from the root, so it
+        costs O(k log k) regardless of the queue size.
+        '''
+        result = []
+        frontier = [(self._heap[0][0], self._heap[0][1], 0)] if self._heap else []
+        while frontier and len(result) < k:
+            _, _, i = heapq.heappop(frontier)
+            priority, _, key, item = self._heap[i]
+            result.append((key, item, priority))
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (self._heap[child][0], self._heap[child][1], child))
+        return result
+
+    def heap_view(self):
+        return HeapView(self._heap)
+
+    def _remove_at(self, i):
+        removed = self._heap[i]
+        del self._index[removed[2]]
+        last = self._heap.pop()
+        if last is removed:
+            return
+        self._heap[i] = last
+        self._index[last[2]] = i
+        self._sift_up(i)
+        self._sift_down(self._index[last[2]])
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._index[heap[i][2]] = i
+        self._index[heap[j][2]] = j
+
+    def _less(self, i, j):
+        a, b = self._heap[i], self._heap[j]
+        return (a[0], a[1]) < (b[0], b[1])
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self._less(i, parent):
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        n = len(self._heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self._less(child, smallest):
+                    smallest = child
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+from report_queue import ReportQueue
+
+
+logger = logging.getLogger('discord')
+
+
+class ReportScheduler:
+    '''
+    Runs queued report cases on a fixed number of concurrent workers, in
+    priority order. `queue` is a ReportQueue keyed by case, so queued cases
+    can be reprioritized or withdrawn. Workers sleep on a condition and wake
+    as soon as something is queued, so there is no polling interval.
+
+    put() waits while `max_pending` entries are queued (backpressure), and
+    stop() stops taking new work and lets the workers drain the queue.
+    '''
+    def __init__(
+            self,
+            handler: Callable[[Any], Awaitable[None]],
+            num_workers: int = 4,
+            max_pending: int = 1000,
+        ):
+        self.handler = handler
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.queue = ReportQueue()
+        self.in_flight = 0
+        self.workers = []
+        self.closing = False
+        self.drain = True
+        self._changed = asyncio.Condition()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def start(self):
+        '''
+        Start the workers; calling it again while they run does nothing.
+        '''
+        if self.workers:
+            return
+        self.closing = False
+        self.workers = [
+            asyncio.create_task(self.worker(), name=f'report-worker-{i}') for i in range(self.num_workers)
+        ]
+
+    async def put(self, key: Hashable, item, priority):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.closing or len(self.queue) < self.max_pending)
+            if self.closing:
+                raise RuntimeError('The report scheduler is shutting down')
+            self.queue.push(key, item, priority)
+            self._changed.notify_all()
+
+    def update(self, key: Hashable, priority) -> bool:
+        '''
+        Change the priority of a queued item. Returns False if it is not in
+        the queue (already taken by a worker, or still waiting for space).
+        '''
+        if key not in self.queue:
+            return False
+        self.queue.update(key, priority)
+        return True
+
+    async def remove(self, key: Hashable):
+        '''
+        Withdraw a queued item; returns it, or None if it is not queued.
+        '''
+        async with self._changed:
+            if key not in self.queue:
+                return None
+            item = self.queue.remove(key)
+            # Wake producers waiting for space
+            self._changed.notify_all()
+            return item
+
+    async def worker(self):
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.queue or self.closing)
+                if self.closing and (not self.drain or not self.queue):
+                    return
+                _, item, _ = self.queue.pop()
+                self.in_flight += 1
+                # Wake producers waiting for space
+                self._changed.notify_all()
+            try:
+                await self.handler(item)
+            except Exception:
+                logger.exception('Failed to handle a queued report')
+            finally:
+                async with self._changed:
+                    self.in_flight -= 1
+                    self._changed.notify_all()
+
+    async def stop(self, drain: bool = True, timeout: float = None):
+        '''
+        Stop accepting reports and wait for the workers: with `drain` they
+        first work through the queue, otherwise they only finish the cases in
+        flight. Workers still running after `timeout` seconds are cancelled.
+        '''
+        async with self._changed:
+            self.closing = True
+            self.drain = drain
+            self._changed.notify_all()
+        if not self.workers:
+            return
+        done, pending = await asyncio.wait(self.workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if pending:
+            logger.warning(f'Cancelled {len(pending)} report workers that did not finish in time')
+        self.workers = []
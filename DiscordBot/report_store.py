@@ -0,0 +1,226 @@
+import logging
+import math
+import queue
+import sqlite3
+import threading
+from typing import Optional
+
+
+logger = logging.getLogger('discord')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cases (
+    case_id INTEGER PRIMARY KEY,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    -- 'queued', or 'appeal' once the author has been asked to appeal
+    state TEXT NOT NULL DEFAULT 'queued',
+    thread_id INTEGER,
+    -- Kept with the case so a restart needs no pass over its reports:
+    -- the combined score of its reporters, its number of reports and the
+    -- category of its first report
+    score REAL,
+    num_reports INTEGER NOT NULL DEFAULT 0,
+    category TEXT
+);
+CREATE TABLE IF NOT EXISTS reports (
+    case_id INTEGER NOT NULL,
+    reporter_id INTEGER,
+    score REAL,
+    category TEXT,
+    sub_category TEXT,
+    sub_sub_category TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS reports_by_case ON reports (case_id);
+-- The mod channel messages asking moderators to review an appeal
+CREATE TABLE IF NOT EXISTS review_messages (
+    message_id INTEGER PRIMARY KEY,
+    case_id INTEGER NOT NULL
+);
+'''
+
+# One row per case, in the order the cases were queued
+LOAD_QUERY = '''
+SELECT case_id, guild_id, channel_id, message_id, state, thread_id, score, num_reports, category
+FROM cases ORDER BY case_id
+'''
+
+REPORTS_QUERY = '''
+SELECT reporter_id, score, category, sub_category, sub_sub_category, description
+FROM reports WHERE case_id = ? ORDER BY rowid LIMIT ?
+'''
+
+# Fills the case columns added after the first version of the schema
+MIGRATE_CASES = '''
+ALTER TABLE cases ADD COLUMN score REAL;
+ALTER TABLE cases ADD COLUMN num_reports INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE cases ADD COLUMN category TEXT;
+UPDATE cases SET
+    num_reports = (SELECT COUNT(*) FROM reports r WHERE r.case_id = cases.case_id),
+    category = (SELECT category FROM reports r WHERE r.case_id = cases.case_id ORDER BY rowid LIMIT 1);
+'''
+
+
+class ReportStore:
+    '''
+    Keeps open report cases in SQLite so pending reports and appeals survive
+    a restart. Writes are queued to a background thread, which commits them
+    in batches of up to `batch_size` statements, so the event loop never
+    waits for the disk. The database runs in WAL mode: a commit only appends
+    to the log.
+
+    Every case gets an increasing id when it is added, so loading the cases
+    back in id order gives the order they were first queued.
+    '''
+    def __init__(self, path: str, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._writes = queue.SimpleQueue()
+        self._thread = None
+        conn = self._connect()
+        with conn:
+            self._migrate(conn)
+            conn.executescript(SCHEMA)
+        self._next_id = conn.execute('SELECT IFNULL(MAX(case_id), 0) + 1 FROM cases').fetchone()[0]
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # With WAL this can only lose the last commits on power loss, never corrupt
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _migrate(self, conn):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(cases)')]
+        if not columns or 'num_reports' in columns:
+            return
+        logger.info(f'Adding the case summary columns to {self.path}')
+        conn.executescript(MIGRATE_CASES)
+        # The same product as ReportCase.combined_score, over the first
+        # score of every distinct reporter
+        scores = {}
+        for case_id, reporter_id, score in conn.execute('SELECT case_id, reporter_id, score FROM reports ORDER BY rowid'):
+            scores.setdefault(case_id, {}).setdefault(reporter_id, score)
+        conn.executemany('UPDATE cases SET score = ? WHERE case_id = ?', [
+            (math.prod(min(1.0, max(0.0, score)) for score in reporter_scores.values()), case_id)
+            for case_id, reporter_scores in scores.items()
+        ])
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._write_loop, name='report-store-writer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        '''
+        Write everything queued so far and stop the writer thread. Blocks, so
+        call it from a worker thread when on the event loop.
+        '''
+        if self._thread is None:
+            return
+        self._writes.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _write_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for write in batch:
+                        if write is None:
+                            stop = True
+                        else:
+                            conn.execute(*write)
+            except sqlite3.Error:
+                logger.exception(f'Failed to write {len(batch)} changes to the report store')
+        conn.close()
+
+    def add_case(self, key, report, score, case_score) -> int:
+        '''
+        Record a new case with its first report and return its id, which
+        the other methods take. `case_score` is the combined score of the
+        case (see ReportCase.combined_score).
+        '''
+        case_id = self._next_id
+        self._next_id += 1
+        self._writes.put((
+            'INSERT INTO cases (case_id, guild_id, channel_id, message_id, score, num_reports, category) '
+            'VALUES (?, ?, ?, ?, ?, 1, ?)',
+            (case_id, *key, case_score, report.category),
+        ))
+        self._insert_report(case_id, report, score)
+        return case_id
+
+    def add_report(self, case_id: int, report, score, case_score):
+        self._insert_report(case_id, report, score)
+        self._writes.put((
+            'UPDATE cases SET score = ?, num_reports = num_reports + 1 WHERE case_id = ?',
+            (case_score, case_id),
+        ))
+
+    def _insert_report(self, case_id: int, report, score):
+        self._writes.put((
+            'INSERT INTO reports VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (case_id, report.reporter_id, score, report.category, report.sub_category,
+             report.sub_sub_category, report.report_description),
+        ))
+
+    def set_appeal(self, case_id: int, thread_id: Optional[int]):
+        self._writes.put(("UPDATE cases SET state = 'appeal', thread_id = ? WHERE case_id = ?", (thread_id, case_id)))
+
+    def add_review_message(self, message_id: int, case_id: int):
+        self._writes.put(('INSERT INTO review_messages VALUES (?, ?)', (message_id, case_id)))
+
+    def remove_case(self, case_id: int):
+        self._writes.put(('DELETE FROM reports WHERE case_id = ?', (case_id,)))
+        self._writes.put(('DELETE FROM review_messages WHERE case_id = ?', (case_id,)))
+        self._writes.put(('DELETE FROM cases WHERE case_id = ?', (case_id,)))
+
+    def load(self):
+        '''
+        Yield every stored case as a (case_id, guild_id, channel_id,
+        message_id, state, thread_id, score, num_reports, category) row, in
+        the order the cases were queued. Rows are read as they are consumed,
+        so they are never all held at once. Blocks; meant to run once at
+        startup in a worker thread.
+        '''
+        conn = self._connect()
+        try:
+            yield from conn.execute(LOAD_QUERY)
+        finally:
+            conn.close()
+
+    def load_reports(self, case_id: int, count: int) -> list:
+        '''
+        Read the first `count` reports of a stored case as (reporter_id,
+        score, category, sub_category, sub_sub_category, description) rows,
+        oldest first. Blocks, so call it from a worker thread.
+        '''
+        conn = self._connect()
+        try:
+            return conn.execute(REPORTS_QUERY, (case_id, count)).fetchall()
+        finally:
+            conn.close()
+
+    def load_review_messages(self) -> list:
+        '''
+        Read every stored review message as a (message_id, case_id) row.
+        Blocks; meant to run once at startup in a worker thread.
+        '''
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT message_id, case_id FROM review_messages').fetchall()
+        finally:
+            conn.close()
@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+
+logger = logging.getLogger('discord')
+
+
+class SybilScoreIndex:
+    '''
+    Precomputed Sybil scores keyed by Discord ID, held as a sorted uint64 ID
+    array and a parallel float32 score array. Lookups are a binary search, and
+    reload() swaps in a new snapshot with a single reference assignment, so
+    readers never see a half-loaded index.
+
+    Score files should be replaced atomically (write to a temporary file, then
+    os.replace) so a reload never reads a partially written file.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.stamp = None
+        self._snapshot = (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.float32))
+        if path is not None:
+            self.reload()
+
+    def __len__(self):
+        return len(self._snapshot[0])
+
+    @staticmethod
+    def load_arrays(path):
+        '''
+        Read a score file into sorted (ids, scores) arrays. An .npz written by
+        SybilDetection/export.py already holds them; anything else is read as
+        a {"<discord id>": score} JSON file.
+        '''
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                return data['ids'].astype(np.uint64), data['scores'].astype(np.float32)
+        with open(path) as f:
+            scores = json.load(f)
+        ids = np.fromiter((int(key) for key in scores), dtype=np.uint64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+        order = np.argsort(ids, kind='stable')
+        return ids[order], values[order]
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        '''
+        Load the score file if it changed since the last successful load.
+        Returns True if a new snapshot was installed. On a read error the
+        current snapshot is kept and the load is retried on the next call.
+        '''
+        stamp = self.file_stamp()
+        if stamp is None or stamp == self.stamp:
+            return False
+        try:
+            snapshot = self.load_arrays(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'Could not load Sybil scores from {self.path}: {e}')
+            return False
+        self._snapshot = snapshot
+        self.stamp = stamp
+        logger.info(f'Loaded {len(snapshot[0])} Sybil scores from {self.path}')
+        return True
+
+    def get(self, discord_id, default=None):
+        ids, scores = self._snapshot
+        key = np.uint64(discord_id)
+        i = ids.searchsorted(key)
+        if i < len(ids) and ids[i] == key:
+            return float(scores[i])
+        return default
@@ -0,0 +1,88 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger('discord')
+
+
+class TimerQueue:
+    '''
+    Runs coroutine callbacks after a delay. All timers share one background
+    task that sleeps until the earliest deadline in a heap, so a pending
+    timer costs a heap entry instead of a sleeping task. Each due callback
+    runs in a task of its own, so a slow callback never delays later timers;
+    exceptions are logged.
+    '''
+    def __init__(self):
+        self.timers = []  # heap of (deadline, seq, callback, args)
+        self.task = None
+        self.running = set()  # tasks of the callbacks that have fired
+        self.closing = False
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self.timers)
+
+    def start(self):
+        if self.task is None:
+            self.closing = False
+            self.task = asyncio.create_task(self.run(), name='timer-queue')
+
+    def call_later(self, delay: float, callback: Callable[..., Awaitable[None]], *args):
+        deadline = asyncio.get_running_loop().time() + delay
+        entry = (deadline, next(self._seq), callback, args)
+        heapq.heappush(self.timers, entry)
+        if self.timers[0] is entry:
+            # Wake the runner so it sleeps until the new, earlier deadline
+            self._changed.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while not self.closing:
+            self._changed.clear()
+            if not self.timers:
+                await self._changed.wait()
+                continue
+            delay = self.timers[0][0] - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = loop.time()
+            while self.timers and self.timers[0][0] <= now:
+                self.fire(heapq.heappop(self.timers))
+
+    def fire(self, entry):
+        _, _, callback, args = entry
+        task = asyncio.create_task(callback(*args))
+        self.running.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task):
+        self.running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('A timer callback failed', exc_info=task.exception())
+
+    async def stop(self, run_pending: bool = True):
+        '''
+        Stop the runner and wait for the callbacks that have fired. With
+        `run_pending` the timers not due yet run now, so nothing scheduled is
+        skipped by a shutdown.
+        '''
+        if self.task is not None:
+            self.closing = True
+            self._changed.set()
+            await self.task
+            self.task = None
+        if run_pending:
+            for entry in sorted(self.timers):
+                self.fire(entry)
+            self.timers = []
+        if self.running:
+            await asyncio.wait(self.running)
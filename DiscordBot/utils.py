@@ -1,35 +1,65 @@
-import datetime
 from graphviz import Digraph
 
-def visualize_heap(heap, highlight_report=None, highlight_color="grey"):
+def subtree_size(idx, size):
+    # Number of nodes under (and including) idx in a heap of the given size
+    count = 0
+    lo = hi = idx
+    while lo < size:
+        count += min(hi, size - 1) - lo + 1
+        lo, hi = 2 * lo + 1, 2 * hi + 2
+    return count
+
+def heap_neighborhood(size, highlight=(), top=7, max_nodes=31):
+    '''
+    The heap positions worth drawing: the first `top` positions (the next
+    reports to be handled), plus the path from the root to each highlighted
+    position and its children, as long as the total stays within
+    `max_nodes`. Every parent of a chosen position is chosen too.
+    '''
+    nodes = set(range(min(top, size)))
+    for idx in sorted(highlight):
+        path = [child for child in (2 * idx + 1, 2 * idx + 2) if child < size]
+        while idx >= 0 and idx not in nodes:
+            path.append(idx)
+            idx = (idx - 1) // 2
+        path = [i for i in path if i not in nodes]
+        if len(nodes) + len(path) > max_nodes:
+            break
+        nodes.update(path)
+    return nodes
+
+def visualize_heap(heap, highlight=(), highlight_color="grey", top=7, max_nodes=31):
+    '''
+    Draw a bounded part of a heap of (score, seq, report) entries, given as
+    any sequence in heap array order, with the positions in `highlight`
+    filled in. Subtrees left out are summarized by the number of reports in
+    them, so the graph stays small however long the queue is.
+
+    Returns the graphviz Digraph, or None for an empty heap. Rendering it
+    (e.g. `dot.pipe(format="png")`) runs the `dot` program, so callers on the
+    event loop should do that in a worker thread.
+    '''
     if not heap:
-        return
-    
+        return None
+
     dot = Digraph()
+    size = len(heap)
+    nodes = heap_neighborhood(size, highlight, top, max_nodes)
+    highlight = set(highlight)
 
-    def add_edges(dot, heap, idx):
-        left_idx = 2 * idx + 1
-        right_idx = 2 * idx + 2
-
-        if left_idx < len(heap):
-            dot.edge(str(heap[idx]), str(heap[left_idx]))
-            add_edges(dot, heap, left_idx)
-        
-        if right_idx < len(heap):
-            dot.edge(str(heap[idx]), str(heap[right_idx]))
-            add_edges(dot, heap, right_idx)
-
-    for value in heap:
-        score, time, report = value
-        if report == highlight_report:
-            dot.node(str(value), label=f"{score:.2f}", shape="circle", style="filled", color=highlight_color)
+    for idx in sorted(nodes):
+        score = heap[idx][0]
+        if idx in highlight:
+            dot.node(str(idx), label=f"{score:.2f}", shape="circle", style="filled", color=highlight_color)
         else:
-            dot.node(str(value), label=f"{score:.2f}", shape="circle")
+            dot.node(str(idx), label=f"{score:.2f}", shape="circle")
+        if idx > 0:
+            dot.edge(str((idx - 1) // 2), str(idx))
 
-    add_edges(dot, heap, 0)
+        # Collapse the children that are not drawn into one summary node
+        hidden = sum(subtree_size(child, size) for child in (2 * idx + 1, 2 * idx + 2) if child < size and child not in nodes)
+        if hidden:
+            dot.node(f"{idx}+", label=f"+{hidden}", shape="plaintext")
+            dot.edge(str(idx), f"{idx}+", style="dashed")
 
-    timestamp = timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"heap_{timestamp}"
-    dot.render(filename, format="png", cleanup=True)
-    
-    return filename + ".png"
\ No newline at end of file
+    return dot